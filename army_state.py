@@ -0,0 +1,94 @@
+from typing import Callable, Collection, List, Tuple
+from collections import Counter
+from dataclasses import dataclass
+from units import Unit
+from unit_table import UNIT_CLASSES, UNIT_INDEX, army_from_counts
+
+# Order independent description of an army as (index in `UNIT_CLASSES`, already attacked, count) entries
+ArmyKey = Tuple[Tuple[int, bool, int], ...]
+
+
+@dataclass(frozen=True)
+class ArmyState:
+    """
+    One side of a battle at a single point in time
+
+    `units` are the unit definitions the side started with and a battle never changes them, so any number of
+    battles may share them. What has happened to each unit in this battle is kept in the flags, by position
+    """
+    units: Tuple[Unit, ...]
+    alive: Tuple[bool, ...]
+    attacked: Tuple[bool, ...] # used for those units with `initial_attack_only = True`, shows that an attack has already happened
+
+    @classmethod
+    def from_units(cls, units: List[Unit]) -> "ArmyState":
+        return cls(tuple(units), (True,) * len(units), (False,) * len(units))
+
+    @classmethod
+    def from_key(cls, key: ArmyKey) -> "ArmyState":
+        """
+        Creates fresh units matching `key`, ordered like `UNIT_CLASSES`
+        """
+        units = army_from_counts((UNIT_CLASSES[unit_index], count) for unit_index, _, count in key)
+        attacked = [already_attacked for _, already_attacked, count in key for _ in range(count)]
+        return cls(tuple(units), (True,) * len(units), tuple(attacked))
+
+    def __len__(self) -> int:
+        return sum(self.alive)
+
+    def __str__(self):
+        return str(self.living)
+
+    def __repr__(self):
+        return str(self)
+
+    @property
+    def indices(self) -> List[int]:
+        """
+        Positions of the living units
+        """
+        return [index for index, alive in enumerate(self.alive) if alive]
+
+    @property
+    def living(self) -> List[Unit]:
+        return [unit for unit, alive in zip(self.units, self.alive) if alive]
+
+    def can_attack(self, index: int) -> bool:
+        return not (self.units[index].initial_attack_only and self.attacked[index])
+
+    def where(self, predicate: Callable[[Unit], bool]) -> "ArmyState":
+        """
+        Only the living units which match `predicate`
+        """
+        return ArmyState(self.units, tuple(alive and predicate(unit) for unit, alive in zip(self.units, self.alive)), self.attacked)
+
+    def only(self, indices: Collection[int]) -> "ArmyState":
+        """
+        Only the living units at `indices`
+        """
+        indices = set(indices)
+        return ArmyState(self.units, tuple(alive and index in indices for index, alive in enumerate(self.alive)), self.attacked)
+
+    def without(self, indices: Collection[int]) -> "ArmyState":
+        """
+        The army after the units at `indices` are killed
+        """
+        indices = set(indices)
+        return ArmyState(self.units, tuple(alive and index not in indices for index, alive in enumerate(self.alive)), self.attacked)
+
+    def after_attack(self, firing: "ArmyState") -> "ArmyState":
+        """
+        The army after the living units of `firing`, a selection of this army, have fired
+        """
+        attacked = tuple(
+            already_attacked or (fired and unit.initial_attack_only)
+            for unit, already_attacked, fired in zip(self.units, self.attacked, firing.alive)
+        )
+        return ArmyState(self.units, self.alive, attacked)
+
+    def key(self) -> ArmyKey:
+        """
+        Counts the living units by class and whether they have used up their initial attack
+        """
+        counts = Counter((UNIT_INDEX[type(self.units[index])], self.attacked[index]) for index in self.indices)
+        return tuple(sorted((unit_index, attacked, count) for (unit_index, attacked), count in counts.items()))
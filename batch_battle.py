@@ -0,0 +1,148 @@
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from units import Unit, TargetSelect
+from terrains import Terrain
+from battle import BattleResult
+from unit_table import ATTACK_COUNT, TARGET_SELECT_CODES
+from markov_battle import MarkovBattle, BattlePhase
+from dice import Seed
+
+
+def distinct_rows(rows: np.ndarray, radices: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    `np.unique(rows, axis=0, return_inverse=True)`, but rows are packed into single integers first when every
+    column `i` is below `radices[i]`, which is far quicker than sorting whole rows
+    """
+    if np.prod(radices.astype(float)) >= 2 ** 62:
+        distinct, inverse = np.unique(rows, axis=0, return_inverse=True)
+        return distinct, inverse.reshape(-1)
+
+    place_values = np.cumprod(np.concatenate([[1], radices[:-1]])).astype(np.int64)
+    _, first, inverse = np.unique(rows @ place_values, return_index=True, return_inverse=True)
+    return rows[first], inverse.reshape(-1)
+
+
+class BatchBattle:
+    """
+    Fights `n` copies of the same battle at once on NumPy arrays
+
+    Each side is an (n, unit class) array of surviving unit counts. All the dice of a round are drawn in a single call,
+    and casualties use the same selection as `MarkovBattle`, worked out once per distinct army state
+    """
+    def __init__(self, attackers: List[Unit], defenders: List[Unit], terrain: Terrain, n: int, seed: Optional[Seed] = None, antithetic: bool = False):
+        self.rules: MarkovBattle = MarkovBattle(attackers, defenders, terrain)
+        self.n: int = n
+        self.rng: np.random.Generator = np.random.default_rng(seed)
+        self.antithetic: bool = antithetic # every roll d is turned into 13 - d, see `AntitheticDiceBackend`
+
+        self.current_attackers: np.ndarray = np.tile(np.array(self.rules.initial_attackers, dtype=np.int64), (n, 1))
+        self.current_defenders: np.ndarray = np.tile(np.array(self.rules.initial_defenders, dtype=np.int64), (n, 1))
+        self.rounds: np.ndarray = np.zeros(n, dtype=np.int64)
+        self.count_radices: np.ndarray = np.maximum(self.rules.initial_attackers, self.rules.initial_defenders).astype(np.int64) + 1
+
+        self.aircraft = np.array(self.rules.aircraft)
+        self.ground_naval = np.array(self.rules.targetable[TargetSelect.ground_and_naval])
+        self.vehicle = np.array(self.rules.targetable[TargetSelect.vehicle])
+        self.firing_lines: Dict[BattlePhase, np.ndarray] = {phase: np.array(self.rules.firing_lines[phase]) for phase in BattlePhase}
+
+        attack_counts = self.rules.stats[:, ATTACK_COUNT].astype(np.int64)
+        self.attacking_shots: int = int(self.current_attackers[0] @ attack_counts) if n else 0
+        self.defending_shots: int = int(self.current_defenders[0] @ attack_counts) if n else 0
+        self._faces: Dict[tuple, Tuple[np.ndarray, np.ndarray, np.ndarray]] = {}
+
+    def get_faces(self, firing: Tuple[int, ...], attack: bool, phase: BattlePhase, width: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Gets the (hit faces, regular hit faces, target select code) of every shot by `firing`, padded with misses to `width`
+        """
+        key = (firing, attack, phase)
+        if key not in self._faces:
+            hit_faces = np.zeros(width, dtype=np.int64)
+            regular_faces = np.zeros(width, dtype=np.int64)
+            select_codes = np.zeros(width, dtype=np.int64)
+            for index, (regular, select, select_type) in enumerate(self.rules.get_phase_shots(firing, attack, phase)):
+                hit_faces[index] = regular + select
+                regular_faces[index] = regular
+                select_codes[index] = TARGET_SELECT_CODES[select_type]
+            self._faces[key] = hit_faces, regular_faces, select_codes
+        return self._faces[key]
+
+    def fire(self, units: np.ndarray, attack: bool, phase: BattlePhase, rolls: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Scores `rolls` for every battle's firing line of `units`
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: Hits as (ground/naval select, vehicle select, total) rows, and whether each side could hit at all
+        """
+        width = rolls.shape[1]
+        firing = units * self.firing_lines[phase]
+        distinct, inverse = distinct_rows(firing, self.count_radices)
+        faces = [self.get_faces(tuple(row), attack, phase, width) for row in distinct.tolist()]
+
+        hit_faces = np.stack([x[0] for x in faces])[inverse]
+        regular_faces = np.stack([x[1] for x in faces])[inverse]
+        select_codes = np.stack([x[2] for x in faces])[inverse]
+
+        hit = rolls <= hit_faces
+        select = hit & (rolls > regular_faces)
+        hits = np.stack([
+            (select & (select_codes == TARGET_SELECT_CODES[TargetSelect.ground_and_naval])).sum(axis=1),
+            (select & (select_codes == TARGET_SELECT_CODES[TargetSelect.vehicle])).sum(axis=1),
+            hit.sum(axis=1),
+        ], axis=1)
+        return hits, hit_faces.sum(axis=1) > 0
+
+    def take_losses(self, units: np.ndarray, hits: np.ndarray, attack: bool, phase: BattlePhase) -> np.ndarray:
+        """
+        Removes the casualties of `hits` from every battle's `units`
+        """
+        caps = np.stack([(units * self.ground_naval).sum(axis=1), (units * self.vehicle).sum(axis=1), units.sum(axis=1)], axis=1)
+        states = np.concatenate([units, np.minimum(hits, caps)], axis=1)
+        radices = np.concatenate([self.count_radices, np.full(3, self.count_radices.sum())])
+        distinct, inverse = distinct_rows(states, radices)
+
+        class_count = units.shape[1]
+        survivors = np.array([
+            self.rules.take_losses(tuple(row[:class_count]), tuple(row[class_count:]), attack, phase) for row in distinct.tolist()
+        ], dtype=np.int64).reshape(len(distinct), class_count)
+        return survivors[inverse]
+
+    def battle_round(self, active: np.ndarray, phase: BattlePhase) -> np.ndarray:
+        """
+        Fights a round in the battles at indices `active`
+        Returns:
+            np.ndarray: Whether either side was able to score a hit in each battle
+        """
+        attackers = self.current_attackers[active]
+        defenders = self.current_defenders[active]
+        rolls = self.rng.integers(1, 13, size=(len(active), self.attacking_shots + self.defending_shots))
+        if self.antithetic:
+            rolls = 13 - rolls
+
+        attacking_hits, attackers_armed = self.fire(attackers, True, phase, rolls[:, :self.attacking_shots])
+        defending_hits, defenders_armed = self.fire(defenders, False, phase, rolls[:, self.attacking_shots:])
+
+        self.current_attackers[active] = self.take_losses(attackers, defending_hits, True, phase)
+        self.current_defenders[active] = self.take_losses(defenders, attacking_hits, False, phase)
+        return attackers_armed | defenders_armed
+
+    def results(self) -> np.ndarray:
+        """
+        `BattleResult` values of every battle, mirrors the end of `Battle.battle`
+        """
+        attacker_victory = (self.current_defenders.sum(axis=1) == 0) & (self.current_attackers.sum(axis=1) > 0)
+        if not self.rules.air_battle:
+            attacker_victory &= (self.current_attackers * ~self.aircraft).sum(axis=1) > 0
+        return np.where(attacker_victory, BattleResult.attacker_victory.value, BattleResult.defender_victory.value)
+
+    def battle(self) -> np.ndarray:
+        everyone = np.arange(self.n)
+        self.battle_round(everyone, BattlePhase.first_strike)
+        self.battle_round(everyone, BattlePhase.second_strike)
+
+        active = everyone[(self.current_attackers.sum(axis=1) > 0) & (self.current_defenders.sum(axis=1) > 0)]
+        while len(active):
+            armed = self.battle_round(active, BattlePhase.general)
+            self.rounds[active] += 1
+            # Battles where neither side can hit anymore never end, the attack fails to take the territory
+            active = active[armed & (self.current_attackers[active].sum(axis=1) > 0) & (self.current_defenders[active].sum(axis=1) > 0)]
+
+        return self.results()
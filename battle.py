@@ -1,16 +1,30 @@
-from typing import List, Tuple
+from typing import Callable, Dict, Iterator, List, Sequence, Tuple, Type
 from enum import Enum
+from abc import ABC, abstractmethod
 from terrains import *
-from units import Unit
-from dice import d12_less, d12
-from itertools import combinations
-from dataclasses import dataclass
+from units import Unit, pair_artillery
+from dice import d12_less, DiceSource, DICE
+from unit_table import UNIT_INDEX
+from army_state import ArmyState, ArmyKey
+from dataclasses import dataclass, fields
+from collections import defaultdict
+from functools import lru_cache
+from time import perf_counter
+import logging
+
+logger = logging.getLogger(__name__)
 
 class BattleResult(Enum):
     attacker_victory = 1
     defender_victory = 2
 
 
+class Verbosity(Enum):
+    silent = 1 # nothing is displayed, or even formatted
+    summary = 2 # the sides before and after the battle, and the result
+    trace = 3 # the sides before every round as well
+
+
 @dataclass
 class RoundResult:
     regular_losses: int
@@ -21,27 +35,157 @@ class RoundResult:
         return self.regular_losses + self.vehicle_select_losses + self.ground_naval_losses
 
 
-def unit_fights(unit: Unit, comrades: List[Unit], terrain:Terrain, attack: bool, battle_result: RoundResult, initial_round: bool):
+@dataclass
+class BattleStats:
     """
-    Simulates a single unit and their comrades fighting in a given terrain. Will inflict casualties in mutated `battle_result` object
+    Counters and wall time of the battles it is passed to, summed over all of them. Nothing is counted or timed
+    unless one is passed, and each phase's time includes the casualty selection within it
     """
-    d12_value = d12()
+    rounds: int = 0 # rounds of fire, the first and second strike included
+    shots: int = 0
+    loss_combinations: int = 0 # candidate losses enumerated by the casualty selectors and `get_potential_loss_combinations`
+    evaluations: int = 0 # calls to `objectively_evaluate_armies`
+    first_strike_seconds: float = 0
+    second_strike_seconds: float = 0
+    general_round_seconds: float = 0
+    casualty_selection_seconds: float = 0
+
+    def add(self, other: "BattleStats"):
+        """
+        Adds `other` into these stats in place
+        """
+        for field in fields(self):
+            setattr(self, field.name, getattr(self, field.name) + getattr(other, field.name))
+
+    def __add__(self, other: "BattleStats") -> "BattleStats":
+        return BattleStats(*(getattr(self, x.name) + getattr(other, x.name) for x in fields(self)))
+
+    def lap(self, phase: str, started: float) -> float:
+        """
+        Adds the time since `started` to the `phase` seconds, returns the time now to start the next phase from
+        """
+        now = perf_counter()
+        setattr(self, phase, getattr(self, phase) + now - started)
+        return now
+
+
+# A single shot as (regular hit faces, target select hit faces, target select type) out of the 12 faces of a d12
+Shot = Tuple[int, int, Optional[TargetSelect]]
+
+# Army compositions `get_expected_hit_faces` and `evaluate_army_keys` each remember, the least recently used are dropped
+EVALUATION_CACHE_SIZE = 1 << 16
+
+# Exact probability of every `RoundResult`, keyed by (regular_losses, vehicle_select_losses, ground_naval_losses)
+LossDistribution = Dict[Tuple[int, int, int], float]
+
+
+TARGET_SELECT_UNIT_TYPES: Dict[TargetSelect, List[UnitType]] = {
+    TargetSelect.ground_and_naval: [
+        UnitType.vehicle,
+        UnitType.aa,
+        UnitType.artilery,
+        UnitType.infantry,
+        UnitType.naval
+    ],
+    TargetSelect.vehicle: [
+        UnitType.vehicle
+    ],
+}
+
 
+@dataclass
+class FiringLine:
+    """
+    The units of a side which fire in a round, with the synergy between them worked out once for the whole round
+    """
+    units: List[Unit]
+    paired: List[bool] # whether each of `units` is paired with an artillery
+    fortified: bool # a fortification fights alongside them
+
+    @classmethod
+    def from_army(cls, army: ArmyState) -> "FiringLine":
+        comrades = army.living
+        units = [army.units[index] for index in army.indices if army.can_attack(index)]
+        return cls(units, pair_artillery(units, comrades), any(x.unit_type == UnitType.fortification for x in comrades))
+
+    def shots(self) -> Iterator[Tuple[Unit, bool]]:
+        """
+        Every shot of the round, as the unit firing it and whether that unit is paired
+        """
+        for unit, paired in zip(self.units, self.paired):
+            for _ in range(unit.attack_count):
+                yield unit, paired
+
+
+def get_combat_value(unit: Unit, paired: bool, fortified: bool, terrain: Terrain, attack: bool, initial_round: bool) -> int:
+    """
+    Gets the value a d12 must roll at or under for `unit` to score a hit
+    Args:
+        paired (bool): The unit is paired with an artillery, see `FiringLine`
+        fortified (bool): A fortification fights alongside the unit
+    """
     if attack:
         initial_combat_value = unit.attack_roll
-        combat_value = terrain.modified_attack(unit, comrades)
+        combat_value = terrain.modified_attack(unit, paired)
     else:
         initial_combat_value = unit.defense_roll
-        combat_value = terrain.modified_defense(unit, comrades)
+        combat_value = terrain.modified_defense(unit, paired)
 
     # Fortification gives a combat buff to infantry on the initial round
-    if initial_round and any(x.unit_type == UnitType.fortification for x in comrades):
+    if initial_round and fortified:
         combat_value += 2
 
     # Combat value cannot be modified to be less than 2
     if combat_value <= 1 and initial_combat_value >= 1:
         combat_value = 1
 
+    return combat_value
+
+
+def get_hit_faces(unit: Unit, paired: bool, fortified: bool, terrain: Terrain, attack: bool, initial_round: bool) -> Tuple[int, int]:
+    """
+    Gets how many faces of the d12 give `unit` a regular hit and how many give it a target select hit
+    """
+    hit_faces = max(0, min(get_combat_value(unit, paired, fortified, terrain, attack, initial_round), 12))
+    if not unit.can_target_select:
+        return hit_faces, 0
+
+    select_faces = max(0, hit_faces - unit.target_select_roll + 1)
+    return hit_faces - select_faces, select_faces
+
+
+def add_shot_distribution(distribution: LossDistribution, regular_faces: int, select_faces: int, target_select: Optional[TargetSelect]) -> LossDistribution:
+    """
+    Convolves a single shot into `distribution`
+    """
+    miss = (12 - regular_faces - select_faces) / 12
+    result = defaultdict(float)
+    for (regular, vehicle, ground), probability in distribution.items():
+        if miss:
+            result[(regular, vehicle, ground)] += probability * miss
+        if regular_faces:
+            result[(regular + 1, vehicle, ground)] += probability * regular_faces / 12
+        if select_faces:
+            if target_select == TargetSelect.ground_and_naval:
+                result[(regular, vehicle, ground + 1)] += probability * select_faces / 12
+            elif target_select == TargetSelect.vehicle:
+                result[(regular, vehicle + 1, ground)] += probability * select_faces / 12
+            else:
+                raise Exception("This target selection type was not taken into account")
+    return result
+
+
+def unit_fights(unit: Unit, paired: bool, fortified: bool, terrain:Terrain, attack: bool, battle_result: RoundResult, initial_round: bool, dice: DiceSource = DICE):
+    """
+    Simulates a single unit and their comrades fighting in a given terrain. Will inflict casualties in mutated `battle_result` object
+    Args:
+        paired (bool): The unit is paired with an artillery, see `FiringLine`
+        fortified (bool): A fortification fights alongside the unit
+        dice (DiceSource): Where the roll comes from
+    """
+    d12_value = dice.d12()
+    combat_value = get_combat_value(unit, paired, fortified, terrain, attack, initial_round)
+
     # Hit scored?
     if d12_value <= combat_value:
         # Target select scored?
@@ -59,219 +203,502 @@ def unit_fights(unit: Unit, comrades: List[Unit], terrain:Terrain, attack: bool,
             battle_result.regular_losses += 1
 
 
-def get_losses(attackers: List[Unit], defenders: List[Unit], terrain: Terrain, *,simulation: bool = False, initial_round: bool = False) -> Tuple[RoundResult, RoundResult]:
+def get_losses(attackers: ArmyState, defenders: ArmyState, terrain: Terrain, *, initial_round: bool = False, dice: DiceSource = DICE, stats: Optional[BattleStats] = None) -> Tuple[RoundResult, RoundResult]:
     """
     Gets number of units that die in a round of combat, does not say which units, but specifies the unit types targetted by target select
     Args:
-        attackers (List[Unit]): All attacking units which may fight
-        defenders (List[Unit]): All defending which may fight
-        simulation (Bool): This attack should not have lasting effects on the battle
+        attackers (ArmyState): All attacking units which may fight
+        defenders (ArmyState): All defending which may fight
+        dice (DiceSource): Where the rolls come from
+        stats (Optional[BattleStats]): Counts the shots fired
     """
     attack_results = RoundResult(0, 0, 0)
     defend_results = RoundResult(0, 0, 0)
-    for attacker in attackers:
-        attacker.simulation = simulation
-        if not attacker.can_attack():
-            continue
+    attacking_line = FiringLine.from_army(attackers)
+    for attacker, paired in attacking_line.shots():
+        unit_fights(attacker, paired, attacking_line.fortified, terrain, True, defend_results, initial_round, dice)
 
-        for _ in range(attacker.attack_count):
-            unit_fights(attacker, attackers, terrain, True, defend_results, initial_round)
+    defending_line = FiringLine.from_army(defenders)
+    for defender, paired in defending_line.shots():
+        unit_fights(defender, paired, defending_line.fortified, terrain, False, attack_results, initial_round, dice)
 
-    for defender in defenders:
-        defender.simulation = simulation
-        if not defender.can_attack():
-            continue
+    if stats is not None:
+        stats.shots += sum(x.attack_count for x in attacking_line.units) + sum(x.attack_count for x in defending_line.units)
+    return attack_results, defend_results
 
-        for _ in range(defender.attack_count):
-            unit_fights(defender, defenders, terrain, False, attack_results, initial_round)
 
-    for attacker in attackers:
-        attacker.simulation = False
-        attacker.reset_synergy()
+def get_shots(army: ArmyState, terrain: Terrain, attack: bool, initial_round: bool) -> List[Shot]:
+    """
+    Gets every shot `army` fires in a round, in the same order as `get_losses`
+    """
+    line = FiringLine.from_army(army)
+    return [
+        (*get_hit_faces(unit, paired, line.fortified, terrain, attack, initial_round), unit.target_select_type)
+        for unit, paired in line.shots()
+    ]
+
 
-    for defender in defenders:
-        defender.simulation = False
-        defender.reset_synergy()
+def get_loss_distributions(attackers: ArmyState, defenders: ArmyState, terrain: Terrain, *, initial_round: bool = False) -> Tuple[LossDistribution, LossDistribution]:
+    """
+    Exact version of `get_losses`, gives the probability of every possible `RoundResult` of each side instead of rolling one
+    Args:
+        attackers (ArmyState): All attacking units which may fight
+        defenders (ArmyState): All defending which may fight
+    """
+    attack_results: LossDistribution = {(0, 0, 0): 1.0}
+    defend_results: LossDistribution = {(0, 0, 0): 1.0}
+    for regular_faces, select_faces, target_select in get_shots(attackers, terrain, True, initial_round):
+        defend_results = add_shot_distribution(defend_results, regular_faces, select_faces, target_select)
 
+    for regular_faces, select_faces, target_select in get_shots(defenders, terrain, False, initial_round):
+        attack_results = add_shot_distribution(attack_results, regular_faces, select_faces, target_select)
 
     return attack_results, defend_results
 
 
-def objectively_evaluate_armies(attackers: List[Unit], defenders: List[Unit], terrain: Terrain) -> float:
+@lru_cache(maxsize=EVALUATION_CACHE_SIZE)
+def get_expected_hit_faces(army: ArmyKey, terrain: Terrain, attack: bool) -> int:
+    """
+    Expected hits of an army in a round after the initial round, in twelfths of a hit so that equal armies tie exactly
+    """
+    return sum(regular_faces + select_faces for regular_faces, select_faces, _ in get_shots(ArmyState.from_key(army), terrain, attack, False))
+
+
+@lru_cache(maxsize=EVALUATION_CACHE_SIZE)
+def evaluate_army_keys(attackers: ArmyKey, defenders: ArmyKey, terrain: Terrain) -> float:
+    return (get_expected_hit_faces(defenders, terrain, False) - get_expected_hit_faces(attackers, terrain, True)) / 12
+
+
+def clear_evaluation_caches():
+    """
+    Empties the caches of `get_expected_hit_faces` and `evaluate_army_keys`
+    """
+    get_expected_hit_faces.cache_clear()
+    evaluate_army_keys.cache_clear()
+
+
+def objectively_evaluate_armies(attackers: ArmyState, defenders: ArmyState, terrain: Terrain, stats: Optional[BattleStats] = None) -> float:
     """
     Generates an objective score which evaluates the effectiveness of the attacking army to cause casualties
     while also weighing its survivalbility
+
+    The score is the expected attacker losses minus defender losses of a round, worked out from the compositions
+    of both armies and cached on them so scoring the same armies again is free
+    Args:
+        stats (Optional[BattleStats]): Counts the call
+    """
+    if stats is not None:
+        stats.evaluations += 1
+    return evaluate_army_keys(attackers.key(), defenders.key(), terrain)
+
+def get_loss_compositions(available: Tuple[int, ...], loss_count: int, stats: Optional[BattleStats] = None) -> Iterator[Tuple[int, ...]]:
+    """
+    Every distinct way to lose `loss_count` units out of groups of interchangeable units, given as the number lost
+    from each group. Earlier groups lose as many units as possible first
+    Args:
+        stats (Optional[BattleStats]): Counts every composition given
     """
-    simulation_results = []
-    for _ in range(20):
-        attack_losses, defense_losses = get_losses(attackers, defenders, terrain, simulation=True)
-        simulation_results.append(attack_losses.loss_sum()-defense_losses.loss_sum())
-    return sum(simulation_results)
-
-def get_potential_loss_combinations(units: List[Unit], loss_count: int, target_select: Optional[TargetSelect] = None) -> List[List[Unit]]:
-
-    if target_select:
-        if target_select == TargetSelect.ground_and_naval:
-            units = [x for x in units if x.unit_type in [
-                UnitType.vehicle,
-                UnitType.aa,
-                UnitType.artilery,
-                UnitType.infantry,
-                UnitType.naval
-            ]]
-        elif target_select == TargetSelect.vehicle:
-            units = [x for x in units if x.unit_type in [
-                UnitType.vehicle
-            ]]
-
-    units = [x for x in units if not x.already_dead]
-
-    if len(units) == 0:
+    indices = [index for index, amount in enumerate(available) if amount]
+    remaining = [sum(available[index] for index in indices[position + 1:]) for position in range(len(indices))]
+    taken = [0] * len(available)
+
+    def pick(position: int, count: int) -> Iterator[Tuple[int, ...]]:
+        if position == len(indices):
+            if stats is not None:
+                stats.loss_combinations += 1
+            yield tuple(taken)
+            return
+        index = indices[position]
+        for amount in range(min(available[index], count), max(0, count - remaining[position]) - 1, -1):
+            taken[index] = amount
+            yield from pick(position + 1, count - amount)
+        taken[index] = 0
+
+    return pick(0, loss_count)
+
+
+def get_loss_groups(army: ArmyState, target_select: Optional[TargetSelect] = None) -> List[List[int]]:
+    """
+    Splits the positions of the living units which may be lost into groups of interchangeable units: the same class
+    with the same attacked flag. Groups are ordered like `ArmyState.key`
+    """
+    groups: Dict[Tuple[Type[Unit], bool], List[int]] = {}
+    for index in army.indices:
+        unit = army.units[index]
+        if target_select and unit.unit_type not in TARGET_SELECT_UNIT_TYPES[target_select]:
+            continue
+        groups.setdefault((type(unit), army.attacked[index]), []).append(index)
+    return [groups[key] for key in sorted(groups, key=lambda x: (UNIT_INDEX[x[0]], x[1]))]
+
+
+def compose_losses(groups: List[List[int]], composition: Sequence[int]) -> List[int]:
+    return [index for group, count in zip(groups, composition) for index in group[:count]]
+
+
+def get_potential_loss_combinations(army: ArmyState, loss_count: int, target_select: Optional[TargetSelect] = None, stats: Optional[BattleStats] = None) -> List[List[int]]:
+    """
+    Gets the positions of every distinct group of `loss_count` units which may be lost. Interchangeable units are
+    grouped by `get_loss_groups`, so each composition of losses is only given once
+    Args:
+        stats (Optional[BattleStats]): Passed on to `get_loss_compositions`
+    """
+    groups = get_loss_groups(army, target_select)
+    indices = [x for group in groups for x in group]
+
+    if len(indices) == 0:
         return [[],]
 
-    if len(units) <= loss_count:
-        return [units,]
+    if len(indices) <= loss_count:
+        return [indices,]
 
     if loss_count == 0:
         return [[],]
 
     loss_combinations = []
-    for combination in combinations(units, loss_count):
-        loss_combinations.append(combination)
+    for composition in get_loss_compositions(tuple(len(x) for x in groups), loss_count, stats):
+        loss_combinations.append(compose_losses(groups, composition))
     return loss_combinations
-    
 
-def loss_selector(attackers: List[Unit], defenders: List[Unit], attacking_losses: int, defending_losses: int, terrain: Terrain, target_select: Optional[TargetSelect] = None,) -> Tuple[List[Unit], List[Unit]]:
-    """
-    Selects the best units for each side to lose by simulating the effectiveness of each army 
 
-    Takes into account the effect of each possible loss by simulating how effective each army
-    is against the other after taking those losses.
+@dataclass
+class LossProblem:
+    """
+    A side which has to lose `loss_count` units out of `groups`, positions in `army`
     """
-    potential_attacker_loss_combinations = get_potential_loss_combinations(attackers, attacking_losses, target_select)
-    attacker_losses = potential_attacker_loss_combinations.pop()
-    best_attacker_loss_score = objectively_evaluate_armies(attacker_losses, defenders, terrain)
-    for loss_combination in potential_attacker_loss_combinations:
-        attacker_loss_score = objectively_evaluate_armies(loss_combination, defenders, terrain)
-        if (not target_select and attacker_loss_score > best_attacker_loss_score) or (target_select and attacker_loss_score < best_attacker_loss_score):
-            best_attacker_loss_score = attacker_loss_score
-            attacker_losses = loss_combination
+    army: ArmyState
+    groups: List[List[int]]
+    loss_count: int
+    enemy: ArmyState
+    terrain: Terrain
+    attack: bool
+    target_select: Optional[TargetSelect] = None
+    stats: Optional[BattleStats] = None # counts the candidates enumerated and their evaluations
 
-    potential_defender_loss_combinations = get_potential_loss_combinations(defenders, defending_losses, target_select)
-    defender_losses = potential_defender_loss_combinations.pop()
-    best_defender_loss_score = (0 -  objectively_evaluate_armies(attackers, defender_losses, terrain))
-    for loss_combination in potential_defender_loss_combinations:
-        defender_loss_score = (0 - objectively_evaluate_armies(attackers, loss_combination, terrain))
-        if (not target_select and defender_loss_score > best_defender_loss_score) or (target_select and defender_loss_score < best_defender_loss_score):
-            best_defender_loss_score = defender_loss_score
-            defender_losses = loss_combination
+    def losses(self, composition: Sequence[int]) -> List[int]:
+        return compose_losses(self.groups, composition)
+
+    def firepower(self, composition: Sequence[int]) -> int:
+        return get_expected_hit_faces(self.army.only(self.losses(composition)).key(), self.terrain, self.attack)
+
+    def score(self, composition: Sequence[int]) -> float:
+        return self.score_losses(self.losses(composition))
+
+    def score_losses(self, losses: List[int]) -> float:
+        """
+        How good losing the units at `losses` is for the side, the weakest units score best unless the enemy
+        target selected them, in which case the strongest are lost
+        """
+        losses = self.army.only(losses)
+        if self.attack:
+            score = objectively_evaluate_armies(losses, self.enemy, self.terrain, self.stats)
+        else:
+            score = 0 - objectively_evaluate_armies(self.enemy, losses, self.terrain, self.stats)
+        return -score if self.target_select else score
 
-    return list(attacker_losses), list(defender_losses)
 
-def mark_dead(killed_units: List[Unit]):
+class CasualtySelector(ABC):
     """
-    Marks the units as killed
+    Strategy which `loss_selector` uses to pick the units a side loses
+    Args:
+        time_budget (Optional[float]): Seconds one selection may take before settling for the best losses found so far
     """
-    for unit in killed_units:
-        unit.already_dead = True
+    def __init__(self, time_budget: Optional[float] = None):
+        self.time_budget: Optional[float] = time_budget
+
+    def out_of_time(self, started: float) -> bool:
+        return self.time_budget is not None and perf_counter() - started > self.time_budget
+
+    def select(self, army: ArmyState, loss_count: int, enemy: ArmyState, terrain: Terrain, attack: bool, target_select: Optional[TargetSelect] = None, stats: Optional[BattleStats] = None) -> List[int]:
+        """
+        Gets the positions in `army` of the units it loses
+        Args:
+            stats (Optional[BattleStats]): Counts the candidate losses enumerated and their evaluations
+        """
+        groups = get_loss_groups(army, target_select)
+        available = sum(len(x) for x in groups)
+        if available <= loss_count:
+            return [x for group in groups for x in group]
+
+        if loss_count == 0:
+            return []
 
-def battle_round_simulation(attacking_targets: List[Unit], defending_targets: List[Unit], attackers: List[Unit], defenders: List[Unit], terrain: Terrain, initial_round: bool) -> Tuple[Unit, Unit]:
+        problem = LossProblem(army, groups, loss_count, enemy, terrain, attack, target_select, stats)
+        return problem.losses(self.select_composition(problem))
+
+    @abstractmethod
+    def select_composition(self, problem: LossProblem) -> Tuple[int, ...]:
+        """
+        Gets how many units of each of `problem.groups` to lose, aiming for the highest `problem.score`
+        """
+
+
+class ExhaustiveSelector(CasualtySelector):
     """
-    Simulates a round of fire between targets and casualty selection. Returns all survivors
-    Args:
-        attacking_targets (List[Unit]): All attacking units which may be targetted by the attack
-        defending_targets (List[Unit]): All defending units which may be targetted by the attack
-        attackers (List[Unit]): All attacking units which may attack another unit, subset of `attacking_targets`
-        defenders (List[Unit]): All defending which may attack another unit, subset of `defending_targets`
+    Scores every distinct composition of losses
+    """
+    def select_composition(self, problem: LossProblem) -> Tuple[int, ...]:
+        started = perf_counter()
+        best_composition = None
+        best_score = None
+        for composition in get_loss_compositions(tuple(len(x) for x in problem.groups), problem.loss_count, problem.stats):
+            score = problem.score(composition)
+            if best_score is None or score > best_score:
+                best_score = score
+                best_composition = composition
+            if self.out_of_time(started):
+                break
+        return best_composition
+
+
+class GreedySelector(CasualtySelector):
     """
+    Loses one unit at a time, always the one which leaves the best scoring losses so far. This is approximate, it
+    can settle for losses which score below those of `ExhaustiveSelector`, see `get_selection_regret`
+    """
+    def select_composition(self, problem: LossProblem) -> Tuple[int, ...]:
+        started = perf_counter()
+        composition = [0] * len(problem.groups)
+        for lost in range(problem.loss_count):
+            if self.out_of_time(started):
+                # Out of time, the rest are lost in group order
+                for index, group in enumerate(problem.groups):
+                    taken = min(len(group) - composition[index], problem.loss_count - lost)
+                    composition[index] += taken
+                    lost += taken
+                break
+
+            best_index = None
+            best_score = None
+            for index, group in enumerate(problem.groups):
+                if composition[index] == len(group):
+                    continue
+                composition[index] += 1
+                if problem.stats is not None:
+                    problem.stats.loss_combinations += 1
+                score = problem.score(composition)
+                composition[index] -= 1
+                if best_score is None or score > best_score:
+                    best_score = score
+                    best_index = index
+            composition[best_index] += 1
+        return tuple(composition)
+
+
+class BranchAndBoundSelector(CasualtySelector):
+    """
+    Searches the compositions like `ExhaustiveSelector`, starting from the greedy losses and skipping any branch whose
+    bound on the hit faces of the lost units shows it can not beat the best found.
 
-    # Get attacks and losses of target-selecting
+    The bound takes each unit's hit faces on its own as the least it adds, and that plus the most a single friendly
+    unit's synergy gives it as the most it adds
+    """
+    def select_composition(self, problem: LossProblem) -> Tuple[int, ...]:
+        started = perf_counter()
+        # The greedy losses share the time budget, and are what is returned if it runs out before the search
+        best_composition = GreedySelector(self.time_budget).select_composition(problem)
+        if self.out_of_time(started):
+            return best_composition
+
+        group_sizes = [len(x) for x in problem.groups]
+        solo_faces = [get_expected_hit_faces(problem.army.only(group[:1]).key(), problem.terrain, problem.attack) for group in problem.groups]
+        synergy_faces = [0] * len(problem.groups)
+        for index, group in enumerate(problem.groups):
+            if self.out_of_time(started):
+                return best_composition
+            for other_index, other_group in enumerate(problem.groups):
+                if index == other_index and len(group) < 2:
+                    continue
+                pair_faces = get_expected_hit_faces(problem.army.only([group[0], other_group[-1]]).key(), problem.terrain, problem.attack)
+                synergy_faces[index] = max(synergy_faces[index], pair_faces - solo_faces[index] - solo_faces[other_index])
+
+        # Losing the strongest units when target selected, the weakest otherwise
+        maximize = bool(problem.target_select)
+        unit_bounds = [solo + synergy for solo, synergy in zip(solo_faces, synergy_faces)] if maximize else solo_faces
+
+        best_score = problem.score(best_composition)
+        best_faces = problem.firepower(best_composition)
+        composition = [0] * len(problem.groups)
+
+        def bound(position: int, remaining: int, faces: int) -> int:
+            # Best hit faces the losses can end up with, taking the best units from the groups still open
+            for unit_bound, size in sorted(zip(unit_bounds[position:], group_sizes[position:]), reverse=maximize):
+                taken = min(size, remaining)
+                faces += taken * unit_bound
+                remaining -= taken
+            return faces
+
+        def search(position: int, remaining: int, faces: int):
+            nonlocal best_composition, best_score, best_faces
+            if self.out_of_time(started):
+                return
+
+            if position == len(problem.groups):
+                if remaining == 0:
+                    if problem.stats is not None:
+                        problem.stats.loss_combinations += 1
+                    score = problem.score(composition)
+                    if score > best_score:
+                        best_score = score
+                        best_composition = tuple(composition)
+                        best_faces = problem.firepower(composition)
+                return
+
+            bound_faces = bound(position, remaining, faces)
+            if (maximize and bound_faces <= best_faces) or (not maximize and bound_faces >= best_faces):
+                return
+
+            later_units = sum(group_sizes[position + 1:])
+            for taken in range(min(group_sizes[position], remaining), max(0, remaining - later_units) - 1, -1):
+                composition[position] = taken
+                search(position + 1, remaining - taken, faces + taken * unit_bounds[position])
+            composition[position] = 0
+
+        search(0, problem.loss_count, 0)
+        return best_composition
+
+
+def get_selection_regret(casualty_selector: CasualtySelector, army: ArmyState, loss_count: int, enemy: ArmyState, terrain: Terrain, attack: bool, target_select: Optional[TargetSelect] = None) -> float:
+    """
+    How far the losses `casualty_selector` picks score below the exhaustive optimum, 0 when it finds the best losses
+    """
+    problem = LossProblem(army, get_loss_groups(army, target_select), loss_count, enemy, terrain, attack, target_select)
+    best_losses = ExhaustiveSelector().select(army, loss_count, enemy, terrain, attack, target_select)
+    selected_losses = casualty_selector.select(army, loss_count, enemy, terrain, attack, target_select)
+    return problem.score_losses(best_losses) - problem.score_losses(selected_losses)
 
-    # Get attacks and losses of non-target-selecting 
-    attacking_loss_count, defending_loss_count = get_losses(attackers, defenders, terrain, initial_round=initial_round)
-    attacking_ground_losses, defending_ground_losses = loss_selector(attacking_targets, defending_targets, attacking_loss_count.ground_naval_losses, defending_loss_count.ground_naval_losses, terrain, TargetSelect.ground_and_naval)
-    mark_dead(attacking_ground_losses)
-    mark_dead(defending_ground_losses)
-    attacking_vehicle_losses, defending_vehicle_losses = loss_selector(attacking_targets, defending_targets, attacking_loss_count.vehicle_select_losses, defending_loss_count.vehicle_select_losses, terrain, TargetSelect.vehicle)
-    mark_dead(attacking_vehicle_losses)
-    mark_dead(defending_vehicle_losses)
-    attacking_general_losses, defending_general_losses = loss_selector(attacking_targets, defending_targets, attacking_loss_count.loss_sum(), defending_loss_count.loss_sum(), terrain)
 
-    attacking_losses = attacking_general_losses + attacking_vehicle_losses + attacking_ground_losses
-    defending_losses = defending_general_losses + defending_vehicle_losses + defending_ground_losses
+def loss_selector(attackers: ArmyState, defenders: ArmyState, attacking_losses: int, defending_losses: int, terrain: Terrain, target_select: Optional[TargetSelect] = None, casualty_selector: Optional[CasualtySelector] = None, stats: Optional[BattleStats] = None) -> Tuple[ArmyState, ArmyState]:
+    """
+    Selects the best units for each side to lose by simulating the effectiveness of each army 
 
-    all_attacking_survivors = []
-    all_defending_survivors = []
+    Takes into account the effect of each possible loss by simulating how effective each army
+    is against the other after taking those losses. Returns both armies after their losses
+    Args:
+        casualty_selector (Optional[CasualtySelector]): How the losses are searched for, every composition is scored by default
+        stats (Optional[BattleStats]): Passed on to `CasualtySelector.select`
+    """
+    casualty_selector = casualty_selector or ExhaustiveSelector()
+    attacker_losses = casualty_selector.select(attackers, attacking_losses, defenders, terrain, True, target_select, stats)
+    defender_losses = casualty_selector.select(defenders, defending_losses, attackers, terrain, False, target_select, stats)
+    return attackers.without(attacker_losses), defenders.without(defender_losses)
 
-    for attacker in (attacking_targets + attackers):
-        attacker.already_dead = False
-        if attacker not in attacking_losses and attacker not in all_attacking_survivors:
-            all_attacking_survivors.append(attacker)
 
-    for defender in (defending_targets + defenders):
-        defender.already_dead = False
-        if defender not in defending_losses and defender not in all_defending_survivors:
-            all_defending_survivors.append(defender)
+def battle_round_simulation(attacking_targets: ArmyState, defending_targets: ArmyState, attackers: ArmyState, defenders: ArmyState, terrain: Terrain, initial_round: bool, casualty_selector: Optional[CasualtySelector] = None, dice: DiceSource = DICE, stats: Optional[BattleStats] = None) -> Tuple[ArmyState, ArmyState]:
+    """
+    Simulates a round of fire between targets and casualty selection. Returns all survivors
+    Args:
+        attacking_targets (ArmyState): All attacking units which may be targetted by the attack
+        defending_targets (ArmyState): All defending units which may be targetted by the attack
+        attackers (ArmyState): All attacking units which may attack another unit, subset of `attacking_targets`
+        defenders (ArmyState): All defending which may attack another unit, subset of `defending_targets`
+        casualty_selector (Optional[CasualtySelector]): Passed on to `loss_selector`
+        dice (DiceSource): Where the rolls come from
+        stats (Optional[BattleStats]): Counts the round and its shots and losses, and times the casualty selection
+    """
+    attacking_loss_count, defending_loss_count = get_losses(attackers, defenders, terrain, initial_round=initial_round, dice=dice, stats=stats)
+    attacking_targets = attacking_targets.after_attack(attackers)
+    defending_targets = defending_targets.after_attack(defenders)
+    if stats is not None:
+        stats.rounds += 1
+        started = perf_counter()
 
-    return all_attacking_survivors, all_defending_survivors
+    # Target selected losses are taken first, then the general losses out of whoever is left
+    attacking_targets, defending_targets = loss_selector(attacking_targets, defending_targets, attacking_loss_count.ground_naval_losses, defending_loss_count.ground_naval_losses, terrain, TargetSelect.ground_and_naval, casualty_selector, stats)
+    attacking_targets, defending_targets = loss_selector(attacking_targets, defending_targets, attacking_loss_count.vehicle_select_losses, defending_loss_count.vehicle_select_losses, terrain, TargetSelect.vehicle, casualty_selector, stats)
+    survivors = loss_selector(attacking_targets, defending_targets, attacking_loss_count.loss_sum(), defending_loss_count.loss_sum(), terrain, casualty_selector=casualty_selector, stats=stats)
+    if stats is not None:
+        stats.lap("casualty_selection_seconds", started)
+    return survivors
 
 
 
 class Battle:
-    def __init__(self, attackers: List[Unit], defenders: List[Unit], terrain: Terrain):
+    """
+    A single battle fought with dice
+    Args:
+        verbosity (Verbosity): How much of the battle is displayed
+        display (Optional[Callable[[str], None]]): Receives what is displayed, logged at info level by default
+        dice (DiceSource): Where the rolls come from, the shared `dice.DICE` by default
+        stats (Optional[BattleStats]): Counts and times the battle's phases, nothing is measured if not given
+    """
+    def __init__(self, attackers: List[Unit], defenders: List[Unit], terrain: Terrain, casualty_selector: Optional[CasualtySelector] = None, *, verbosity: Verbosity = Verbosity.trace, display: Optional[Callable[[str], None]] = None, dice: DiceSource = DICE, stats: Optional[BattleStats] = None):
         self.original_attackers: List[Unit] = attackers
         self.original_defenders: List[Unit] = defenders
 
-        self.current_attackers: List[Unit] = [x for x in attackers]
-        self.current_defenders: List[Unit] = [x for x in defenders]
+        self.current_attackers: ArmyState = ArmyState.from_units(attackers)
+        self.current_defenders: ArmyState = ArmyState.from_units(defenders)
         self.terrain: Terrain = terrain
-
-
-    def simulate_battle_round(self, attacking_targets: List[Unit], defending_targets: List[Unit], attackers: List[Unit], defenders: List[Unit], initial_round: bool):
+        self.casualty_selector: Optional[CasualtySelector] = casualty_selector
+        self.rounds: int = 0 # general rounds fought after the first and second strike
+        self.dice: DiceSource = dice
+        self.stats: Optional[BattleStats] = stats
+        self.verbosity: Verbosity = verbosity
+        self.display: Callable[[str], None] = display or logger.info
+        if display is None and not logger.isEnabledFor(logging.INFO):
+            self.verbosity = Verbosity.silent
+
+    def simulate_battle_round(self, attacking_targets: ArmyState, defending_targets: ArmyState, attackers: ArmyState, defenders: ArmyState, initial_round: bool):
         """
         Simulates only a single round of defense/offense
         """
-        attacking_survivors, defending_survivors = battle_round_simulation(attacking_targets, defending_targets, attackers, defenders, self.terrain, initial_round)
+        attacking_survivors, defending_survivors = battle_round_simulation(attacking_targets, defending_targets, attackers, defenders, self.terrain, initial_round, self.casualty_selector, self.dice, self.stats)
         self.current_attackers = attacking_survivors
         self.current_defenders = defending_survivors
 
     def first_strike(self):
-        attackers = [unit for unit in self.current_attackers if unit.first_strike]
-        defenders = [unit for unit in self.current_defenders if unit.first_strike]
+        attackers = self.current_attackers.where(lambda unit: unit.first_strike)
+        defenders = self.current_defenders.where(lambda unit: unit.first_strike)
         self.simulate_battle_round(self.current_attackers, self.current_defenders, attackers, defenders, True)
 
     def second_strike(self):
         """
         Now all units _without_ `first_strike` fire
         """
-        attackers = [unit for unit in self.current_attackers if not unit.first_strike]
-        defenders = [unit for unit in self.current_defenders if not unit.first_strike]
+        attackers = self.current_attackers.where(lambda unit: not unit.first_strike)
+        defenders = self.current_defenders.where(lambda unit: not unit.first_strike)
         self.simulate_battle_round(self.current_attackers, self.current_defenders, attackers, defenders, True)
 
-    def display_sides(self):
-        print("ATTACKERS:")
-        print(self.current_attackers)
-        print("DEFENDERS:")
-        print(self.current_defenders)
-        print("___________________________")
+    def display_sides(self, verbosity: Verbosity = Verbosity.summary):
+        """
+        Displays both sides if the battle is at least as verbose as `verbosity`
+        """
+        if self.verbosity.value < verbosity.value:
+            return
+        self.display(f"ATTACKERS:\n{self.current_attackers}\nDEFENDERS:\n{self.current_defenders}\n___________________________")
 
     def battle(self) -> BattleResult:
-        air_battle = all(x.unit_type == UnitType.aircraft for x in self.current_attackers) or all(x.unit_type == UnitType.aircraft for x in self.current_defenders)
+        air_battle = all(x.unit_type == UnitType.aircraft for x in self.current_attackers.living) or all(x.unit_type == UnitType.aircraft for x in self.current_defenders.living)
         self.display_sides()
+        stats = self.stats
+        started = perf_counter() if stats is not None else 0
         self.first_strike()
+        if stats is not None:
+            started = stats.lap("first_strike_seconds", started)
         self.second_strike()
-        self.display_sides()
+        if stats is not None:
+            started = stats.lap("second_strike_seconds", started)
+        self.display_sides(Verbosity.trace)
         while self.current_attackers and self.current_defenders:
-            self.display_sides()
+            self.display_sides(Verbosity.trace)
             self.simulate_battle_round(self.current_attackers, self.current_defenders, self.current_attackers, self.current_defenders, False)
+            self.rounds += 1
+        if stats is not None:
+            stats.lap("general_round_seconds", started)
+
+        result = self.get_result(air_battle)
+        self.display_sides()
+        if self.verbosity != Verbosity.silent:
+            self.display(f"{result.name} after {self.rounds} rounds")
+        return result
 
+    def get_result(self, air_battle: bool) -> BattleResult:
         if self.current_defenders:
             return BattleResult.defender_victory
 
         if self.current_attackers:
             if air_battle:
                 return BattleResult.attacker_victory
-            if any(x.unit_type != UnitType.aircraft for x in self.current_attackers):
+            if any(x.unit_type != UnitType.aircraft for x in self.current_attackers.living):
                 return BattleResult.attacker_victory
 
         return BattleResult.defender_victory
\ No newline at end of file
@@ -1,87 +1,427 @@
 from units import Unit
-from typing import List, Dict
-from battle import Battle, BattleResult
+from typing import Dict, Iterator, List, Optional, Tuple, Type
+from battle import Battle, BattleResult, BattleStats, Verbosity
+from markov_battle import MarkovBattle
+from unit_table import army_from_counts
+from batch_battle import BatchBattle
 from terrains import Terrain
-import contextlib
-import io
+from simulation_executor import SimulationExecutor, get_default_executor
+from confidence_intervals import IntervalMethod, get_win_rate_interval
+from dice import DICE, DiceSource, DiceBackend, NumpyDiceBackend, AntitheticDiceBackend, Seed, as_seed_sequence
+import numpy as np
+from enum import Enum
 from functools import partial
-from math import floor
+from math import floor, ceil, sqrt
+from statistics import fmean, stdev
+import random
+from dataclasses import dataclass, field, fields
+from time import perf_counter
 
-from multiprocessing import Pool
-from itertools import combinations
 
-def _simulate_battle_result(attackers: List[Unit], defenders: List[Unit], terrain:Terrain, *args) -> int:
+# Battles fought to measure how long one battle takes before the rest are split into chunks
+PROBE_BATTLES = 16
+# Seconds of battles each chunk sent to a worker should take, long enough that sending it costs next to nothing
+TARGET_CHUNK_SECONDS = 0.25
+# Chunks each worker should get at least, so that they all finish at about the same time
+CHUNKS_PER_WORKER = 4
+# When seeded, every block of this many battles rolls its own dice stream and chunks are made of whole blocks, so each
+# battle's dice only depend on its position and never on how the battles were split between the workers
+SEED_BLOCK_BATTLES = PROBE_BATTLES
+# Rolls drawn at a time for the dice of a block
+SEED_BLOCK_BUFFER = 1 << 10
+# Rolls drawn at a time for each battle of a variance reduced comparison, most battles need fewer
+PAIRED_BATTLE_BUFFER = 1 << 8
+
+
+@dataclass
+class SimulationTally:
+    """
+    Totals of a number of Monte Carlo battles of the same matchup
+    """
+    battles: int = 0
+    attacker_wins: int = 0
+    defender_wins: int = 0
+    rounds: int = 0 # general rounds, summed over every battle
+    attacking_survivors: int = 0 # summed over every battle
+    defending_survivors: int = 0 # summed over every battle
+    seconds: float = 0 # time spent fighting, summed over every battle
+    stats: BattleStats = field(default_factory=BattleStats) # left at zero unless the battles were instrumented
+
+    def __add__(self, other: "SimulationTally") -> "SimulationTally":
+        return SimulationTally(*(getattr(self, x.name) + getattr(other, x.name) for x in fields(self)))
+
+    @property
+    def win_rate(self) -> float:
+        return self.attacker_wins / self.battles if self.battles else 0
+
+    @property
+    def seconds_per_battle(self) -> float:
+        return self.seconds / self.battles if self.battles else 0
+
+
+def _simulate_battle_chunk(attackers: List[Unit], defenders: List[Unit], terrain:Terrain, battles: int, streams: Optional[List[np.random.SeedSequence]] = None, instrument: bool = False) -> SimulationTally:
     """
-    Helper function to be ran inside of a thread
+    Helper function to be ran inside of a worker, fights `battles` battles and sends back only their totals
+    Args:
+        streams (Optional[List[np.random.SeedSequence]]): Seeds of the dice of each block of `SEED_BLOCK_BATTLES` battles, the shared dice are rolled if not given
+        instrument (bool): Every battle adds its `BattleStats` to the tally's
     """
-    with contextlib.redirect_stdout(io.StringIO()): # hide print statement output
-        battle = Battle(attackers, defenders, terrain)
+    tally = SimulationTally()
+    stats = tally.stats if instrument else None
+    started = perf_counter()
+    dice = DICE
+    for index in range(battles):
+        if streams is not None and index % SEED_BLOCK_BATTLES == 0:
+            dice = DiceSource(NumpyDiceBackend(streams[index // SEED_BLOCK_BATTLES]), SEED_BLOCK_BUFFER)
+        battle = Battle(attackers, defenders, terrain, verbosity=Verbosity.silent, dice=dice, stats=stats)
         if battle.battle() == BattleResult.attacker_victory:
-            return 1
-        return 0
+            tally.attacker_wins += 1
+        else:
+            tally.defender_wins += 1
+        tally.rounds += battle.rounds
+        tally.attacking_survivors += len(battle.current_attackers)
+        tally.defending_survivors += len(battle.current_defenders)
+    tally.battles = battles
+    tally.seconds = perf_counter() - started
+    return tally
+
+
+def get_chunk_sizes(n: int, seconds_per_battle: float, workers: int, block: int = 1) -> List[int]:
+    """
+    Splits `n` battles into chunks which each take about `TARGET_CHUNK_SECONDS`, while giving every worker
+    at least `CHUNKS_PER_WORKER` chunks when there are enough battles
+    Args:
+        block (int): Every chunk but the last is a multiple of this many battles
+    """
+    if n <= 0:
+        return []
+
+    chunk_size = floor(TARGET_CHUNK_SECONDS / seconds_per_battle) if seconds_per_battle > 0 else n
+    chunk_size = max(1, min(chunk_size, ceil(n / (workers * CHUNKS_PER_WORKER))))
+    chunk_size = ceil(chunk_size / block) * block
+    chunks = [chunk_size] * (n // chunk_size)
+    if n % chunk_size:
+        chunks.append(n % chunk_size)
+    return chunks
+
+
+def simulate_battle_tally(attackers: List[Unit], defenders: List[Unit], terrain:Terrain, n:int=10_000, *, executor: Optional[SimulationExecutor] = None, seed: Optional[Seed] = None, instrument: bool = False) -> SimulationTally:
+    """
+    Fights `n` Monte Carlo battles on the workers of `executor` and totals them up
+
+    A few battles are fought here first to time them, then the rest go out in chunks sized by `get_chunk_sizes`,
+    so every worker receives the matchup once per chunk and sends back a single `SimulationTally`
+    Args:
+        executor (Optional[SimulationExecutor]): The shared default executor if not given
+        seed (Optional[Seed]): Makes the tally reproducible whatever the number of workers, see `SEED_BLOCK_BATTLES`
+        instrument (bool): Collects the `BattleStats` of every battle into the tally
+    """
+    executor = executor or get_default_executor()
+    streams = None
+    if seed is not None:
+        streams = as_seed_sequence(seed).spawn(ceil(n / SEED_BLOCK_BATTLES))
+
+    probe = min(n, PROBE_BATTLES)
+    tally = _simulate_battle_chunk(attackers, defenders, terrain, probe, streams and streams[:1], instrument)
+    tasks = []
+    block = probe // SEED_BLOCK_BATTLES
+    for chunk in get_chunk_sizes(n - probe, tally.seconds_per_battle, executor.processes, SEED_BLOCK_BATTLES):
+        blocks = ceil(chunk / SEED_BLOCK_BATTLES)
+        tasks.append((chunk, streams and streams[block:block + blocks], instrument))
+        block += blocks
+
+    part = partial(_simulate_battle_chunk, attackers, defenders, terrain)
+    for chunk_tally in executor.starmap(part, tasks, 1):
+        tally += chunk_tally
+    return tally
+
+class BattleEngine(Enum):
+    monte_carlo = 1 # `Battle` objects fought on the workers of a `SimulationExecutor`
+    vectorized = 2 # `BatchBattle`, all battles at once with NumPy
+    exact = 3 # `MarkovBattle`, the exact win rate without sampling
+
+
+@dataclass
+class WinRateEstimate:
+    """
+    Attacker win rate with its confidence interval
+    """
+    win_rate: float
+    lower: float
+    upper: float
+    battles: int # battles fought for the estimate, 0 when it is exact
+
+    @property
+    def width(self) -> float:
+        return self.upper - self.lower
+
+
+def count_attacker_wins(attackers: List[Unit], defenders: List[Unit], terrain:Terrain, n:int, *, engine: BattleEngine = BattleEngine.monte_carlo, executor: Optional[SimulationExecutor] = None, seed: Optional[Seed] = None, stats: Optional[BattleStats] = None) -> int:
+    """
+    Fights `n` battles with one of the sampling engines and counts the attacker victories
+    Args:
+        stats (Optional[BattleStats]): The stats of every battle are added to it, only `BattleEngine.monte_carlo` fights `Battle`s
+    """
+    if engine == BattleEngine.vectorized:
+        results = BatchBattle(attackers, defenders, terrain, n, seed).battle()
+        return int((results == BattleResult.attacker_victory.value).sum())
+
+    tally = simulate_battle_tally(attackers, defenders, terrain, n, executor=executor, seed=seed, instrument=stats is not None)
+    if stats is not None:
+        stats.add(tally.stats)
+    return tally.attacker_wins
+
+
+def estimate_battle_results(attackers: List[Unit], defenders: List[Unit], terrain:Terrain, tolerance: float = 0.02, *, confidence: float = 0.95, method: IntervalMethod = IntervalMethod.wilson, batch_size: int = 1_000, max_battles: int = 100_000, engine: BattleEngine = BattleEngine.monte_carlo, executor: Optional[SimulationExecutor] = None, seed: Optional[Seed] = None, stats: Optional[BattleStats] = None) -> WinRateEstimate:
+    """
+    Fights battles in batches of `batch_size` until the confidence interval of the win rate is narrower than
+    `tolerance`, so lopsided matchups stop long before close ones
+    Args:
+        tolerance (float): Widest the interval may be, from its lower to its upper bound
+        max_battles (int): Battles after which the estimate is returned however wide it is
+        seed (Optional[Seed]): Each batch is seeded with the next stream spawned from it
+        stats (Optional[BattleStats]): Passed on to `count_attacker_wins`
+    """
+    if engine == BattleEngine.exact:
+        win_rate = MarkovBattle(attackers, defenders, terrain).attacker_win_probability()
+        return WinRateEstimate(win_rate, win_rate, win_rate, 0)
+
+    wins = 0
+    battles = 0
+    lower, upper = 0.0, 1.0
+    seeds = as_seed_sequence(seed) if seed is not None else None
+    while battles < max_battles and upper - lower >= tolerance:
+        batch = min(batch_size, max_battles - battles)
+        batch_seed = seeds.spawn(1)[0] if seeds else None
+        wins += count_attacker_wins(attackers, defenders, terrain, batch, engine=engine, executor=executor, seed=batch_seed, stats=stats)
+        battles += batch
+        lower, upper = get_win_rate_interval(wins, battles, confidence, method)
+
+    return WinRateEstimate(wins / battles if battles else 0, lower, upper, battles)
 
-def simulate_battle_results(attackers: List[Unit], defenders: List[Unit], terrain:Terrain, n:int=10_000) -> float:
+
+def simulate_battle_results(attackers: List[Unit], defenders: List[Unit], terrain:Terrain, n:int=10_000, *, engine: BattleEngine = BattleEngine.monte_carlo, executor: Optional[SimulationExecutor] = None, tolerance: Optional[float] = None, seed: Optional[Seed] = None, stats: Optional[BattleStats] = None) -> float:
     """
     Simulates the result of an attacker and defender based battle on a specific terrain
+    Args:
+        engine (BattleEngine): How the battles are fought, `n` is ignored by `BattleEngine.exact`
+        executor (Optional[SimulationExecutor]): Workers for `BattleEngine.monte_carlo`, the shared default executor if not given
+        tolerance (Optional[float]): Stop early once the 95% interval of the win rate is this narrow, see `estimate_battle_results`. `n` is then the most battles fought
+        seed (Optional[Seed]): Makes the result reproducible, whatever the number of workers
+        stats (Optional[BattleStats]): Collects the stats of every battle from the workers, see `count_attacker_wins`
+    """
+    if engine == BattleEngine.exact:
+        return MarkovBattle(attackers, defenders, terrain).attacker_win_probability()
+
+    if tolerance is not None:
+        return estimate_battle_results(attackers, defenders, terrain, tolerance, max_battles=n, engine=engine, executor=executor, seed=seed, stats=stats).win_rate
+
+    return count_attacker_wins(attackers, defenders, terrain, n, engine=engine, executor=executor, seed=seed, stats=stats) / n
+
+@dataclass
+class ComparisonEstimate:
+    """
+    Result of `compare_armies_in_terrain`, with the standard error of a variance reduced estimate
+    """
+    score: float
+    standard_error: float
+    battles: int
+
+
+def _paired_battle_backends(stream: np.random.SeedSequence) -> Tuple[DiceBackend, DiceBackend]:
+    return NumpyDiceBackend(stream), AntitheticDiceBackend(NumpyDiceBackend(stream))
+
+
+def _compare_armies_chunk(side_1: List[Unit], side_2: List[Unit], terrain: Terrain, streams: List[np.random.SeedSequence]) -> Tuple[List[float], float]:
+    """
+    Helper function to be ran inside of a worker, scores `side_1` against `side_2` once per stream
+    Returns:
+        Tuple[List[float], float]: The score of every stream and the seconds it took
     """
-    attack_wins = 0
-    with Pool(processes=16) as pool:
-        part = partial(_simulate_battle_result, attackers, defenders, terrain)
-        attack_wins = sum(pool.map(part, range(n)))
+    started = perf_counter()
+    scores = []
+    for stream in streams:
+        score = 0
+        for attackers, defenders, attacker_is_side_1 in ((side_1, side_2, True), (side_2, side_1, False)):
+            for backend in _paired_battle_backends(stream):
+                battle = Battle(attackers, defenders, terrain, verbosity=Verbosity.silent, dice=DiceSource(backend, PAIRED_BATTLE_BUFFER))
+                attacker_won = battle.battle() == BattleResult.attacker_victory
+                score += attacker_won == attacker_is_side_1
+        scores.append(score / 4)
+    return scores, perf_counter() - started
+
+
+def _compare_armies_vectorized(side_1: List[Unit], side_2: List[Unit], terrain: Terrain, pairs: int, seed: np.random.SeedSequence) -> List[float]:
+    results = []
+    for attackers, defenders in ((side_1, side_2), (side_2, side_1)):
+        for antithetic in (False, True):
+            battle = BatchBattle(attackers, defenders, terrain, pairs, seed, antithetic)
+            results.append(battle.battle() == BattleResult.attacker_victory.value)
+    return ((results[0].astype(float) + results[1] + (1 - results[2]) + (1 - results[3])) / 4).tolist()
+
 
-    return attack_wins / n
+def estimate_armies_in_terrain(side_1: List[Unit], side_2: List[Unit], terrain: Terrain, n:int=20_000, *, engine: BattleEngine = BattleEngine.monte_carlo, executor: Optional[SimulationExecutor] = None, seed: Optional[Seed] = None) -> ComparisonEstimate:
+    """
+    Variance reduced version of `compare_armies_in_terrain`
 
-def compare_armies_in_terrain(side_1: List[Unit], side_2: List[Unit], terrain: Terrain, n:int=20_000) -> float:
+    The battles are fought in groups of four on one dice stream each: both sides attacking (common random numbers),
+    each with the stream's rolls and with their antithetic 13 - d rolls. Luck then mostly cancels out within a group,
+    and the standard error is worked out from the spread of the group scores. Comparing several armies with the
+    same `seed` shares the streams between them as well
+    Args:
+        n (int): Battles to fight, rounded down to a multiple of four
+    """
+    if engine == BattleEngine.exact:
+        return ComparisonEstimate(compare_armies_in_terrain(side_1, side_2, terrain, engine=engine), 0, 0)
+
+    pairs = max(1, n // 4)
+    seeds = as_seed_sequence(seed)
+    if engine == BattleEngine.vectorized:
+        scores = _compare_armies_vectorized(side_1, side_2, terrain, pairs, seeds)
+    else:
+        executor = executor or get_default_executor()
+        streams = seeds.spawn(pairs)
+        probe = min(pairs, ceil(PROBE_BATTLES / 4))
+        scores, seconds = _compare_armies_chunk(side_1, side_2, terrain, streams[:probe])
+        tasks = []
+        start = probe
+        for chunk in get_chunk_sizes(pairs - probe, seconds / probe, executor.processes):
+            tasks.append((streams[start:start + chunk],))
+            start += chunk
+
+        part = partial(_compare_armies_chunk, side_1, side_2, terrain)
+        for chunk_scores, _ in executor.starmap(part, tasks, 1):
+            scores.extend(chunk_scores)
+
+    standard_error = stdev(scores) / sqrt(len(scores)) if len(scores) > 1 else 0
+    return ComparisonEstimate(fmean(scores), standard_error, len(scores) * 4)
+
+
+def compare_armies_in_terrain(side_1: List[Unit], side_2: List[Unit], terrain: Terrain, n:int=20_000, *, engine: BattleEngine = BattleEngine.monte_carlo, executor: Optional[SimulationExecutor] = None, tolerance: Optional[float] = None, seed: Optional[Seed] = None, variance_reduced: bool = False) -> float:
     """
     Simulates the general results of battles (both attack and defensive) in general
+    Args:
+        tolerance (Optional[float]): Passed on to `simulate_battle_results` for both battles
+        seed (Optional[Seed]): Each battle is seeded with its own stream spawned from it
+        variance_reduced (bool): Use `estimate_armies_in_terrain`, `tolerance` is then ignored
     """
-    battle_type_1_results = simulate_battle_results(side_1, side_2, terrain, int(n/2))
-    battle_type_2_results = 1 - simulate_battle_results(side_2, side_1, terrain, int(n/2))
+    if variance_reduced and engine != BattleEngine.exact:
+        return estimate_armies_in_terrain(side_1, side_2, terrain, n, engine=engine, executor=executor, seed=seed).score
+
+    seed_1, seed_2 = as_seed_sequence(seed).spawn(2) if seed is not None else (None, None)
+    battle_type_1_results = simulate_battle_results(side_1, side_2, terrain, int(n/2), engine=engine, executor=executor, tolerance=tolerance, seed=seed_1)
+    battle_type_2_results = 1 - simulate_battle_results(side_2, side_1, terrain, int(n/2), engine=engine, executor=executor, tolerance=tolerance, seed=seed_2)
     return (battle_type_1_results + battle_type_2_results) / 2
 
 
-def get_all_legal_unit_builds(available_units: List[Unit], money: int) -> List[List[Unit]]:
+# Number of units of each class bought
+UnitBuild = Dict[Type[Unit], int]
+
+
+def army_from_build(build: UnitBuild) -> List[Unit]:
     """
-    Extremely laggy just to generate the legal builds once money >= 9
-    
-    Creating a battle between each one of these will be worse.
-    Look for an AI-based solution or maybe ELO scoring system?
+    Creates fresh units for a build
+    """
+    return army_from_counts(build.items())
+
+
+def get_all_legal_unit_builds(available_units: List[Type[Unit]], money: int) -> Iterator[UnitBuild]:
+    """
+    Lazily yields every legal build exactly once. A build is legal when it costs at most `money` and what is
+    left over can not buy even the cheapest of `available_units`
+
+    Recurses over how many of each class are bought, most first, never going over the money left, so only the
+    current counts are ever kept in memory
     """
     if money <= 0:
-        return []
+        return
 
-    affordable_available_units: List[Unit] = []
-    for unit in available_units:
-        if unit.cost <= money:
-            affordable_available_units.append(unit)
+    unit_classes = list(dict.fromkeys(x for x in available_units if x.cost <= money))
+    if not unit_classes:
+        return
 
-    if not affordable_available_units:
-        return []
+    cheapest_unit_cost = min(x.cost for x in available_units)
+    counts = [0] * len(unit_classes)
+
+    def build(position: int, remaining: int) -> Iterator[UnitBuild]:
+        unit_cost = unit_classes[position].cost
+        if position == len(unit_classes) - 1:
+            # The last class spends as much of the rest as it can, any fewer would leave enough for another of it
+            if remaining % unit_cost < cheapest_unit_cost:
+                counts[position] = remaining // unit_cost
+                yield {unit_class: count for unit_class, count in zip(unit_classes, counts) if count}
+                counts[position] = 0
+            return
+
+        for count in range(remaining // unit_cost, -1, -1):
+            counts[position] = count
+            yield from build(position + 1, remaining - count * unit_cost)
+        counts[position] = 0
+
+    yield from build(0, money)
 
-    if len(affordable_available_units) == 1:
-        afford_count = money / affordable_available_units[0].cost
-        return [{
-            affordable_available_units[0]: afford_count
-        }]
 
-    complete_max_army:List[Unit] = []
+class LegalBuilds:
+    """
+    Counts the legal builds of `get_all_legal_unit_builds`, and picks out single builds, without listing them
+
+    `ways[position][remaining]` is how many legal ways there are to spend `remaining` on the classes from `position`
+    on, worked out once in O(money x classes). Build `k` is the `k`th build `get_all_legal_unit_builds` yields
+    """
+    def __init__(self, available_units: List[Type[Unit]], money: int):
+        self.available_units: List[Type[Unit]] = available_units
+        self.money: int = money
+        self.unit_classes: List[Type[Unit]] = list(dict.fromkeys(x for x in available_units if x.cost <= money)) if money > 0 else []
+
+        self.ways: List[List[int]] = []
+        if not self.unit_classes:
+            return
 
-    for available_unit in affordable_available_units:
-        can_afford_max = floor(money/available_unit.cost)
-        complete_max_army.extend([available_unit] * can_afford_max)
+        cheapest_unit_cost = min(x.cost for x in available_units)
+        last_cost = self.unit_classes[-1].cost
+        self.ways = [[0] * (money + 1) for _ in self.unit_classes]
+        self.ways[-1] = [int(remaining % last_cost < cheapest_unit_cost) for remaining in range(money + 1)]
+        for position in range(len(self.unit_classes) - 2, -1, -1):
+            unit_cost = self.unit_classes[position].cost
+            ways, later_ways = self.ways[position], self.ways[position + 1]
+            for remaining in range(money + 1):
+                # Buying none of this class, or one more on top of a legal way to spend the rest
+                ways[remaining] = later_ways[remaining] + (ways[remaining - unit_cost] if remaining >= unit_cost else 0)
 
-    cheapest_unit_cost = min([x.cost for x in available_units])
+    @property
+    def count(self) -> int:
+        return self.ways[0][self.money] if self.ways else 0
 
+    def __iter__(self) -> Iterator[UnitBuild]:
+        return get_all_legal_unit_builds(self.available_units, self.money)
 
-    legal_build_items = set()
+    def __getitem__(self, k: int) -> UnitBuild:
+        if k < 0:
+            k += self.count
+        if not 0 <= k < self.count:
+            raise IndexError("There are only {} legal builds".format(self.count))
 
-    for i in range(len(complete_max_army)):
-        for combination in combinations(complete_max_army, i):
-            if combination in legal_build_items:
-                continue
-            total_cost = sum([x.cost for x in combination])
-            if total_cost <= money < total_cost + cheapest_unit_cost:
-                legal_build_items.add(combination)
+        build = {}
+        remaining = self.money
+        for position, unit_class in enumerate(self.unit_classes):
+            if position == len(self.unit_classes) - 1:
+                count = remaining // unit_class.cost
+            else:
+                # Most of the class first, like `get_all_legal_unit_builds`
+                for count in range(remaining // unit_class.cost, -1, -1):
+                    ways = self.ways[position + 1][remaining - count * unit_class.cost]
+                    if k < ways:
+                        break
+                    k -= ways
+            if count:
+                build[unit_class] = count
+            remaining -= count * unit_class.cost
+        return build
 
-    return legal_build_items
-    
\ No newline at end of file
+    def sample(self, rng: Optional[random.Random] = None) -> UnitBuild:
+        """
+        Draws a legal build, every build being as likely
+        """
+        if not self.count:
+            raise IndexError("There are no legal builds")
+        return self[(rng or random).randrange(self.count)]
@@ -0,0 +1,276 @@
+from typing import Callable, Dict, List, Optional, Type
+from dataclasses import dataclass, asdict
+from time import perf_counter
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import units as Unit
+import terrains as Terrain
+import dice
+from army_state import ArmyState
+from battle import Battle, Verbosity, FiringLine, RoundResult, unit_fights, get_losses, loss_selector, get_potential_loss_combinations, clear_evaluation_caches
+from battle_statistics import simulate_battle_results, get_all_legal_unit_builds
+from simulation_executor import SimulationExecutor
+
+# Seed the dice are reset to before every case, so every run fights the same battles
+BENCHMARK_SEED = 2024
+
+# Least time a case is repeated for, a single call can take longer
+MIN_CASE_SECONDS = 0.2
+
+# Mixed air and ground armies which every scenario repeats, `SCENARIO_SIZES` times over
+ATTACKER_MIX: List[Type[Unit.Unit]] = [Unit.Infantry, Unit.Infantry, Unit.Artillery, Unit.MediumArmor, Unit.Fighter]
+DEFENDER_MIX: List[Type[Unit.Unit]] = [Unit.Infantry, Unit.Infantry, Unit.TankDestroyer, Unit.AAArtillery, Unit.TacticalBomber]
+SCENARIO_SIZES: Dict[str, int] = {
+    "small": 1,
+    "medium": 3,
+    "large": 6,
+}
+
+# Every terrain, `Desert` included although it is not in `TERRAIN_TYPES`
+BENCHMARK_TERRAINS: List[Type[Terrain.Terrain]] = [*Terrain.TERRAIN_TYPES, Terrain.Desert]
+
+# Units and budgets `get_all_legal_unit_builds` is benchmarked on
+BUILD_UNITS: List[Type[Unit.Unit]] = [Unit.Militia, Unit.Infantry, Unit.Cavalry, Unit.Artillery, Unit.MediumArmor, Unit.TankDestroyer, Unit.Fighter]
+BUILD_BUDGETS: List[int] = [20, 40, 60]
+
+# Battles `simulate_battle_results` fights for every worker count
+SCALING_BATTLES = 1_000
+
+
+@dataclass
+class Scenario:
+    name: str
+    size: str
+    terrain: Type[Terrain.Terrain]
+    attacker_classes: List[Type[Unit.Unit]]
+    defender_classes: List[Type[Unit.Unit]]
+
+    @property
+    def units(self) -> int:
+        return len(self.attacker_classes) + len(self.defender_classes)
+
+    def attackers(self) -> List[Unit.Unit]:
+        return [unit_class() for unit_class in self.attacker_classes]
+
+    def defenders(self) -> List[Unit.Unit]:
+        return [unit_class() for unit_class in self.defender_classes]
+
+
+@dataclass
+class BenchmarkResult:
+    benchmark: str
+    scenario: str
+    size: str
+    terrain: str
+    units: int # attackers and defenders together
+    workers: int
+    caches: str # "cold" when the evaluation caches are emptied before every call, "warm" when they are kept
+    calls: int
+    seconds: float
+    calls_per_second: float
+    items_per_second: float # shots, combinations, battles or builds a second depending on the benchmark
+
+
+def get_scenarios(terrains: Optional[List[Type[Terrain.Terrain]]] = None) -> List[Scenario]:
+    """
+    Every size of army in every terrain, `BENCHMARK_TERRAINS` by default
+    """
+    return [
+        Scenario(f"{size}-{terrain.__name__}", size, terrain, ATTACKER_MIX * repeats, DEFENDER_MIX * repeats)
+        for size, repeats in SCENARIO_SIZES.items()
+        for terrain in terrains or BENCHMARK_TERRAINS
+    ]
+
+
+def time_case(function: Callable[[], int], min_seconds: float = MIN_CASE_SECONDS, cold: bool = False) -> Dict[str, float]:
+    """
+    Calls `function` from freshly seeded dice until at least `min_seconds` of calls have been timed. The dice are
+    only seeded once, since reseeding them refills their whole buffer
+    Args:
+        function (Callable[[], int]): Returns how many items it went through, shots or battles for example
+        cold (bool): Empties the evaluation caches before every call, untimed. Otherwise they are filled by an untimed call first
+    """
+    clear_evaluation_caches()
+    dice.seed(BENCHMARK_SEED)
+    if not cold:
+        function()
+
+    calls = 0
+    items = 0
+    seconds = 0.0
+    while True:
+        if cold:
+            clear_evaluation_caches()
+        started = perf_counter()
+        items += function()
+        seconds += perf_counter() - started
+        calls += 1
+        if seconds >= min_seconds:
+            return {"calls": calls, "seconds": seconds, "calls_per_second": calls / seconds, "items_per_second": items / seconds}
+
+
+def benchmark_scenario(scenario: Scenario, min_seconds: float = MIN_CASE_SECONDS) -> List[BenchmarkResult]:
+    """
+    Times every hot path of a single battle on `scenario`, both with cold and with warm caches
+    """
+    attackers = ArmyState.from_units(scenario.attackers())
+    defenders = ArmyState.from_units(scenario.defenders())
+    terrain = scenario.terrain
+    loss_count = len(defenders) // 3
+    round_shots = sum(x.attack_count for x in FiringLine.from_army(attackers).units) + sum(x.attack_count for x in FiringLine.from_army(defenders).units)
+
+    def fight_units() -> int:
+        line = FiringLine.from_army(attackers)
+        result = RoundResult(0, 0, 0)
+        shots = 0
+        for unit, paired in line.shots():
+            unit_fights(unit, paired, line.fortified, terrain, True, result, False)
+            shots += 1
+        return shots
+
+    def fight_round() -> int:
+        get_losses(attackers, defenders, terrain)
+        return round_shots
+
+    def combinations() -> int:
+        return len(get_potential_loss_combinations(defenders, loss_count))
+
+    def select_losses() -> int:
+        loss_selector(attackers, defenders, loss_count, loss_count, terrain)
+        return 2
+
+    def fight_battle() -> int:
+        Battle(scenario.attackers(), scenario.defenders(), terrain, verbosity=Verbosity.silent).battle()
+        return 1
+
+    cases = {
+        "unit_fights": fight_units,
+        "get_losses": fight_round,
+        "get_potential_loss_combinations": combinations,
+        "loss_selector": select_losses,
+        "Battle.battle": fight_battle,
+    }
+    return [
+        BenchmarkResult(name, scenario.name, scenario.size, terrain.__name__, scenario.units, 1, caches, **time_case(function, min_seconds, caches == "cold"))
+        for name, function in cases.items()
+        for caches in ("cold", "warm")
+    ]
+
+
+def benchmark_worker_scaling(scenario: Scenario, worker_counts: List[int], battles: int = SCALING_BATTLES) -> List[BenchmarkResult]:
+    """
+    Times `simulate_battle_results` on `scenario` with a pool of every size in `worker_counts`. Each pool is started
+    and its caches warmed before it is timed, so only the battles are measured
+    """
+    results = []
+    for workers in worker_counts:
+        with SimulationExecutor(workers) as executor:
+            simulate_battle_results(scenario.attackers(), scenario.defenders(), scenario.terrain, workers, executor=executor, seed=BENCHMARK_SEED)
+
+            def simulate() -> int:
+                simulate_battle_results(scenario.attackers(), scenario.defenders(), scenario.terrain, battles, executor=executor, seed=BENCHMARK_SEED)
+                return battles
+
+            timing = time_case(simulate, 0)
+        results.append(BenchmarkResult("simulate_battle_results", scenario.name, scenario.size, scenario.terrain.__name__, scenario.units, workers, "warm", **timing))
+    return results
+
+
+def benchmark_legal_builds(min_seconds: float = MIN_CASE_SECONDS) -> List[BenchmarkResult]:
+    """
+    Times going through every legal build of `BUILD_UNITS` for each of `BUILD_BUDGETS`
+    """
+    return [
+        BenchmarkResult("get_all_legal_unit_builds", f"builds-{money}", str(money), "", len(BUILD_UNITS), 1, "warm", **time_case(lambda: sum(1 for _ in get_all_legal_unit_builds(BUILD_UNITS, money)), min_seconds))
+        for money in BUILD_BUDGETS
+    ]
+
+
+def get_worker_counts(max_workers: Optional[int] = None) -> List[int]:
+    """
+    Powers of two up to `max_workers`, which is included even when it is not one
+    """
+    max_workers = max_workers or os.cpu_count() or 1
+    counts = []
+    workers = 1
+    while workers < max_workers:
+        counts.append(workers)
+        workers *= 2
+    return counts + [max_workers]
+
+
+def get_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(min_seconds: float = MIN_CASE_SECONDS, max_workers: Optional[int] = None, terrains: Optional[List[Type[Terrain.Terrain]]] = None) -> dict:
+    """
+    Runs the whole suite: every hot path on every scenario, worker scaling of `simulate_battle_results` for every
+    size of army, and legal builds for every budget
+    """
+    results = []
+    for scenario in get_scenarios(terrains):
+        results += benchmark_scenario(scenario, min_seconds)
+
+    worker_counts = get_worker_counts(max_workers)
+    for scenario in get_scenarios([Terrain.Basic]):
+        results += benchmark_worker_scaling(scenario, worker_counts)
+
+    results += benchmark_legal_builds(min_seconds)
+    return {
+        "commit": get_commit(),
+        "created": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "seed": BENCHMARK_SEED,
+        "results": [asdict(result) for result in results],
+    }
+
+
+def result_key(result: dict) -> str:
+    return f"{result['benchmark']} {result['scenario']} workers={result['workers']} caches={result['caches']}"
+
+
+def compare_benchmarks(baseline: dict, current: dict) -> List[str]:
+    """
+    Lines giving the speedup of every case in `current` over the same case in `baseline`, above 1 when faster
+    """
+    baseline_results = {result_key(x): x for x in baseline["results"]}
+    lines = [f"{baseline['commit']} -> {current['commit']}"]
+    for result in current["results"]:
+        key = result_key(result)
+        if key in baseline_results and baseline_results[key]["items_per_second"]:
+            lines.append(f"{key}: {result['items_per_second'] / baseline_results[key]['items_per_second']:.2f}x")
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Times the hot paths of a battle on fixed, seeded scenarios")
+    parser.add_argument("--output", default="bench_output.json", help="JSON file the results are saved to")
+    parser.add_argument("--compare", help="JSON file of an earlier run to print the speedups against")
+    parser.add_argument("--min-seconds", type=float, default=MIN_CASE_SECONDS, help="Least time every case is repeated for")
+    parser.add_argument("--max-workers", type=int, help="Largest pool the scaling is measured with, every CPU by default")
+    args = parser.parse_args()
+
+    report = run_benchmarks(args.min_seconds, args.max_workers)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    for result in report["results"]:
+        print(f"{result_key(result)}: {result['calls_per_second']:.1f} calls/s, {result['items_per_second']:.1f} items/s")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print("\n".join(compare_benchmarks(baseline, report)))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+from typing import Dict, List, Optional, Tuple, Type
+from dataclasses import dataclass
+from math import exp
+import random
+import numpy as np
+from units import Unit, UnitType
+from terrains import Terrain
+from army_state import ArmyState
+from battle import get_expected_hit_faces
+from dice import Seed, as_seed_sequence, as_random_seed
+from battle_statistics import BattleEngine, LegalBuilds, UnitBuild, WinRateEstimate, army_from_build, estimate_battle_results
+from simulation_executor import SimulationExecutor
+
+# Number of units of each class of `BuildOptimizer.unit_classes`
+BuildCounts = Tuple[int, ...]
+
+
+@dataclass
+class BuildResult:
+    build: UnitBuild
+    screening_score: float # the quick estimate of the win rate the build was picked on
+    estimate: WinRateEstimate # win rate of the build from simulating it
+
+
+class BuildOptimizer:
+    """
+    Looks for the builds which do best against `enemy` without going through every legal build
+
+    Simulated annealing moves between legal builds by dropping a unit or two and spending what is freed on random
+    affordable units. Builds are screened by `screening_score`, a Lanchester square law estimate from the expected
+    hits of both armies which costs next to nothing, and the best `finalists` builds screened are then simulated
+    Args:
+        attacking (bool): The builds attack `enemy`, otherwise they defend against it
+        steps (int): Builds screened over every annealing run
+        restarts (int): Annealing runs, each starting from a uniformly random legal build
+        finalists (int): Best screened builds which are simulated
+        tolerance (float): Passed on to `estimate_battle_results` for the finalists, which share their dice streams
+        seed (Optional[Seed]): Seeds both the search and the dice of the finalists
+    """
+    def __init__(self, available_units: List[Type[Unit]], money: int, enemy: List[Unit], terrain: Type[Terrain], *, attacking: bool = True, steps: int = 2_000, restarts: int = 4, finalists: int = 20, tolerance: float = 0.03, max_battles: int = 20_000, engine: BattleEngine = BattleEngine.vectorized, executor: Optional[SimulationExecutor] = None, seed: Optional[Seed] = None):
+        self.legal_builds: LegalBuilds = LegalBuilds(available_units, money)
+        self.unit_classes: List[Type[Unit]] = self.legal_builds.unit_classes
+        self.money: int = money
+        self.cheapest_unit_cost: int = min(x.cost for x in available_units)
+        self.enemy: List[Unit] = enemy
+        self.terrain: Type[Terrain] = terrain
+        self.attacking: bool = attacking
+        self.steps: int = steps
+        self.restarts: int = restarts
+        self.finalists: int = finalists
+        self.tolerance: float = tolerance
+        self.max_battles: int = max_battles
+        self.engine: BattleEngine = engine
+        self.executor: Optional[SimulationExecutor] = executor
+        search_seed, self.battle_seed = as_seed_sequence(seed).spawn(2)
+        self.rng: random.Random = random.Random(as_random_seed(search_seed))
+
+        enemy_state = ArmyState.from_units(enemy)
+        self.enemy_strength: float = get_expected_hit_faces(enemy_state.key(), terrain, not attacking) * len(enemy)
+        self.enemy_aircraft_only: bool = all(x.unit_type == UnitType.aircraft for x in enemy)
+        self._scores: Dict[BuildCounts, float] = {}
+
+    def to_build(self, counts: BuildCounts) -> UnitBuild:
+        return {unit_class: count for unit_class, count in zip(self.unit_classes, counts) if count}
+
+    def to_counts(self, build: UnitBuild) -> BuildCounts:
+        return tuple(build.get(unit_class, 0) for unit_class in self.unit_classes)
+
+    def screening_score(self, counts: BuildCounts) -> float:
+        """
+        Quick estimate of the win rate of a build, its share of the strength of both armies where an army's strength
+        is its expected hits a round times its number of units
+        """
+        if counts not in self._scores:
+            army = army_from_build(self.to_build(counts))
+            strength = get_expected_hit_faces(ArmyState.from_units(army).key(), self.terrain, self.attacking) * len(army)
+            aircraft_only = all(x.unit_type == UnitType.aircraft for x in army)
+            if self.attacking and aircraft_only and not self.enemy_aircraft_only:
+                # Aircraft can not take the territory on their own
+                score = 0.0
+            elif strength + self.enemy_strength == 0:
+                score = 0.5
+            else:
+                score = strength / (strength + self.enemy_strength)
+            self._scores[counts] = score
+        return self._scores[counts]
+
+    def neighbour(self, counts: BuildCounts) -> BuildCounts:
+        """
+        Drops one or two random units and spends the freed money on random affordable units, staying legal
+        """
+        counts = list(counts)
+        for _ in range(self.rng.randint(1, 2)):
+            owned = [index for index, count in enumerate(counts) if count]
+            if owned:
+                counts[self.rng.choice(owned)] -= 1
+
+        remaining = self.money - sum(count * unit_class.cost for count, unit_class in zip(counts, self.unit_classes))
+        while remaining >= self.cheapest_unit_cost:
+            affordable = [index for index, unit_class in enumerate(self.unit_classes) if unit_class.cost <= remaining]
+            index = self.rng.choice(affordable)
+            counts[index] += 1
+            remaining -= self.unit_classes[index].cost
+        return tuple(counts)
+
+    def anneal(self, steps: int, start_temperature: float = 0.05, end_temperature: float = 0.001):
+        """
+        A single simulated annealing run, every build it screens is kept in the screening cache
+        """
+        counts = self.to_counts(self.legal_builds.sample(self.rng))
+        score = self.screening_score(counts)
+        for step in range(steps):
+            temperature = start_temperature * (end_temperature / start_temperature) ** (step / max(1, steps - 1))
+            candidate = self.neighbour(counts)
+            candidate_score = self.screening_score(candidate)
+            if candidate_score >= score or self.rng.random() < exp((candidate_score - score) / temperature):
+                counts, score = candidate, candidate_score
+
+    def finalist_seed(self) -> np.random.SeedSequence:
+        """
+        A copy of the same seed for every finalist, since `estimate_battle_results` spawns its batches from the one it is given
+        """
+        return np.random.SeedSequence(self.battle_seed.entropy, spawn_key=self.battle_seed.spawn_key)
+
+    def estimate(self, counts: BuildCounts) -> WinRateEstimate:
+        army = army_from_build(self.to_build(counts))
+        if self.attacking:
+            return estimate_battle_results(army, self.enemy, self.terrain, self.tolerance, max_battles=self.max_battles, engine=self.engine, executor=self.executor, seed=self.finalist_seed())
+
+        estimate = estimate_battle_results(self.enemy, army, self.terrain, self.tolerance, max_battles=self.max_battles, engine=self.engine, executor=self.executor, seed=self.finalist_seed())
+        return WinRateEstimate(1 - estimate.win_rate, 1 - estimate.upper, 1 - estimate.lower, estimate.battles)
+
+    def optimize(self, k: int = 5) -> List[BuildResult]:
+        """
+        Gets the `k` builds with the best simulated win rates out of the finalists
+        """
+        if not self.legal_builds.count:
+            return []
+
+        for _ in range(self.restarts):
+            self.anneal(max(1, self.steps // self.restarts))
+
+        finalists = sorted(self._scores, key=self._scores.get, reverse=True)[:self.finalists]
+        results = [BuildResult(self.to_build(counts), self._scores[counts], self.estimate(counts)) for counts in finalists]
+        return sorted(results, key=lambda x: x.estimate.win_rate, reverse=True)[:k]
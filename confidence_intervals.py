@@ -0,0 +1,93 @@
+from typing import Tuple
+from enum import Enum
+from math import exp, lgamma, log, sqrt
+from statistics import NormalDist
+
+
+class IntervalMethod(Enum):
+    wilson = 1 # Wilson score interval, quick and close to the nominal confidence
+    clopper_pearson = 2 # exact binomial interval, never narrower than it should be
+
+
+def _continued_fraction(a: float, b: float, x: float) -> float:
+    """
+    Continued fraction of the regularized incomplete beta function, evaluated with Lentz's method
+    """
+    tiny = 1e-300
+    c = 1.0
+    d = 1 - (a + b) * x / (a + 1)
+    d = 1 / (d if abs(d) > tiny else tiny)
+    fraction = d
+    for m in range(1, 1000):
+        for numerator in (
+            m * (b - m) * x / ((a + 2 * m - 1) * (a + 2 * m)),
+            -(a + m) * (a + b + m) * x / ((a + 2 * m) * (a + 2 * m + 1)),
+        ):
+            d = 1 + numerator * d
+            d = 1 / (d if abs(d) > tiny else tiny)
+            c = 1 + numerator / c
+            c = c if abs(c) > tiny else tiny
+            fraction *= c * d
+        if abs(c * d - 1) < 1e-15:
+            break
+    return fraction
+
+
+def regularized_beta(a: float, b: float, x: float) -> float:
+    """
+    The regularized incomplete beta function I_x(a, b), the CDF of a Beta(a, b) distribution at `x`
+    """
+    if x <= 0:
+        return 0.0
+    if x >= 1:
+        return 1.0
+
+    front = exp(lgamma(a + b) - lgamma(a) - lgamma(b) + a * log(x) + b * log(1 - x))
+    if x < (a + 1) / (a + b + 2):
+        return front * _continued_fraction(a, b, x) / a
+    return 1 - front * _continued_fraction(b, a, 1 - x) / b
+
+
+def beta_quantile(q: float, a: float, b: float) -> float:
+    """
+    Inverse of `regularized_beta`, found by bisection
+    """
+    low, high = 0.0, 1.0
+    for _ in range(100):
+        middle = (low + high) / 2
+        if regularized_beta(a, b, middle) < q:
+            low = middle
+        else:
+            high = middle
+    return (low + high) / 2
+
+
+def wilson_interval(wins: int, n: int, confidence: float = 0.95) -> Tuple[float, float]:
+    if n == 0:
+        return 0.0, 1.0
+
+    z = NormalDist().inv_cdf(1 - (1 - confidence) / 2)
+    p = wins / n
+    denominator = 1 + z * z / n
+    center = (p + z * z / (2 * n)) / denominator
+    half_width = z / denominator * sqrt(p * (1 - p) / n + z * z / (4 * n * n))
+    return max(0.0, center - half_width), min(1.0, center + half_width)
+
+
+def clopper_pearson_interval(wins: int, n: int, confidence: float = 0.95) -> Tuple[float, float]:
+    if n == 0:
+        return 0.0, 1.0
+
+    alpha = 1 - confidence
+    lower = beta_quantile(alpha / 2, wins, n - wins + 1) if wins > 0 else 0.0
+    upper = beta_quantile(1 - alpha / 2, wins + 1, n - wins) if wins < n else 1.0
+    return lower, upper
+
+
+def get_win_rate_interval(wins: int, n: int, confidence: float = 0.95, method: IntervalMethod = IntervalMethod.wilson) -> Tuple[float, float]:
+    """
+    Confidence interval of a win rate after `wins` wins out of `n` battles
+    """
+    if method == IntervalMethod.clopper_pearson:
+        return clopper_pearson_interval(wins, n, confidence)
+    return wilson_interval(wins, n, confidence)
@@ -1,12 +1,149 @@
-from random import randint
+from typing import List, Optional, Union
+from abc import ABC, abstractmethod
+import random
+import os
+import numpy as np
+
+# d12 rolls drawn from the backend each time a `DiceSource` runs out
+BUFFER_SIZE = 1 << 16
+
+# An integer seed, or one of the independent streams of `np.random.SeedSequence.spawn`
+Seed = Union[int, np.random.SeedSequence]
+
+
+def as_seed_sequence(seed: Seed) -> np.random.SeedSequence:
+    return seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+
+
+def as_random_seed(seed: Seed) -> int:
+    """
+    An integer seed for `random.Random`, which does not take a `np.random.SeedSequence`
+    """
+    if isinstance(seed, np.random.SeedSequence):
+        return int.from_bytes(seed.generate_state(4, np.uint64).tobytes(), "little")
+    return seed
+
+
+class DiceBackend(ABC):
+    """
+    Random number generator which rolls d12s in bulk for a `DiceSource`
+    Args:
+        seed (Optional[Seed]): Fresh entropy from the OS if not given
+    """
+    def __init__(self, seed: Optional[Seed] = None):
+        self.seed(seed)
+
+    @abstractmethod
+    def seed(self, seed: Optional[Seed] = None):
+        pass
+
+    @abstractmethod
+    def roll(self, count: int) -> np.ndarray:
+        """
+        Rolls `count` d12s, each from 1 to 12
+        """
+
+
+class NumpyDiceBackend(DiceBackend):
+    """
+    Rolls with `numpy.random.Generator.integers`
+    """
+    def seed(self, seed: Optional[Seed] = None):
+        self.rng: np.random.Generator = np.random.default_rng(seed)
+
+    def roll(self, count: int) -> np.ndarray:
+        return self.rng.integers(1, 13, size=count, dtype=np.int64)
+
+
+class GetrandbitsDiceBackend(DiceBackend):
+    """
+    Rolls with `random.Random.getrandbits`, four bits a roll with the values from 12 to 15 thrown away
+    """
+    def seed(self, seed: Optional[Seed] = None):
+        self.rng: random.Random = random.Random(None if seed is None else as_random_seed(seed))
+
+    def roll(self, count: int) -> np.ndarray:
+        rolls = np.empty(0, dtype=np.int64)
+        while len(rolls) < count:
+            # 3/4 of the rolls are kept, so draw a third more than needed, two to a byte
+            wanted = count - len(rolls)
+            byte_count = (wanted * 2) // 3 + 4
+            packed = np.frombuffer(self.rng.getrandbits(byte_count * 8).to_bytes(byte_count, "little"), dtype=np.uint8)
+            nibbles = np.stack([packed & 0x0F, packed >> 4], axis=1).reshape(-1).astype(np.int64)
+            rolls = np.concatenate([rolls, nibbles[nibbles < 12][:wanted] + 1])
+        return rolls
+
+
+class AntitheticDiceBackend(DiceBackend):
+    """
+    Rolls 13 - d for every roll d of `backend`, so a battle rolled with it mirrors the luck of one rolled with `backend`
+    """
+    def __init__(self, backend: DiceBackend):
+        self.backend: DiceBackend = backend
+
+    def seed(self, seed: Optional[Seed] = None):
+        self.backend.seed(seed)
+
+    def roll(self, count: int) -> np.ndarray:
+        return 13 - self.backend.roll(count)
+
+
+class DiceSource:
+    """
+    Hands out d12 rolls which its backend draws `buffer_size` at a time, so a single roll costs only a list pop
+    Args:
+        backend (Optional[DiceBackend]): `NumpyDiceBackend` with fresh entropy by default
+    """
+    def __init__(self, backend: Optional[DiceBackend] = None, buffer_size: int = BUFFER_SIZE):
+        self.backend: DiceBackend = backend or NumpyDiceBackend()
+        self.buffer_size: int = buffer_size
+        self._buffer: List[int] = []
+
+    def seed(self, seed: Optional[Seed] = None):
+        """
+        Reseeds the backend and throws away the rolls it drew before
+        """
+        self.backend.seed(seed)
+        self._buffer = []
+
+    def set_backend(self, backend: DiceBackend):
+        self.backend = backend
+        self._buffer = []
+
+    def d12(self) -> int:
+        try:
+            return self._buffer.pop()
+        except IndexError:
+            self._buffer = self.backend.roll(self.buffer_size).tolist()
+            return self._buffer.pop()
+
+    def d12s(self, count: int) -> np.ndarray:
+        """
+        Rolls `count` d12s at once
+        """
+        return self.backend.roll(count)
+
+
+# The source every `d12` roll comes from unless a battle is given its own
+DICE = DiceSource()
+
+# Forked processes would otherwise roll the same dice as their parent, only POSIX has fork
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=DICE.seed)
 
 
 def d12() -> int:
-    return randint(1, 12)
+    return DICE.d12()
 
 def d12_less(target: int) -> bool:
     """
     Returns:
         bool: Returns true if the d12 hits the target or less
     """
-    return d12() <= target
\ No newline at end of file
+    return d12() <= target
+
+def seed(seed: Optional[Seed] = None):
+    """
+    Seeds the dice of `DICE`, so the battles which follow can be reproduced
+    """
+    DICE.seed(seed)
@@ -0,0 +1,409 @@
+from typing import Dict, Iterable, List, Optional, Set, Tuple, Type
+from enum import Enum
+import numpy as np
+from units import Unit, UnitType, TargetSelect
+from terrains import Terrain
+from unit_table import UNIT_CLASSES, UNIT_INDEX, UNIT_TYPE_CODES, FIRST_STRIKE, INITIAL_ATTACK_ONLY, UNIT_TYPE, army_counts, army_from_counts, has_unit_type, unit_stats
+from army_state import ArmyState
+from battle import TARGET_SELECT_UNIT_TYPES, Shot, get_loss_compositions, get_expected_hit_faces, get_shots, get_loss_distributions
+
+# Number of surviving units of each class in `MarkovBattle.unit_classes`, a slice of `ArmyCounts` with only the classes in the battle
+Composition = Tuple[int, ...]
+
+# Hits scored by a side in a round as (ground/naval select, vehicle select, total)
+LossCounts = Tuple[int, int, int]
+
+# Distinct survivors of a side after a round and the probability of each
+Survivors = Tuple[List[Composition], np.ndarray]
+
+class BattlePhase(Enum):
+    first_strike = 1
+    second_strike = 2
+    general = 3
+
+
+# The phase before each phase, units with `initial_attack_only` have already fired if they fired by then
+PREVIOUS_PHASES: Dict[BattlePhase, Optional[BattlePhase]] = {
+    BattlePhase.first_strike: None,
+    BattlePhase.second_strike: BattlePhase.first_strike,
+    BattlePhase.general: BattlePhase.second_strike,
+}
+
+
+class MarkovBattle:
+    """
+    Solves a `Battle` exactly as a Markov chain over the surviving units of each side
+
+    Casualties are picked with the same expected hits as `objectively_evaluate_armies`, so every army state leads to
+    a single set of survivors for any given number of hits
+    """
+    def __init__(self, attackers: List[Unit], defenders: List[Unit], terrain: Terrain):
+        self.terrain: Terrain = terrain
+        # Ordered like `UNIT_CLASSES`, the same as `ArmyState.key`, so ties between casualties are broken like `loss_selector` does
+        self.unit_indices: List[int] = sorted({UNIT_INDEX[type(x)] for x in attackers + defenders})
+        self.unit_classes: List[Type[Unit]] = [UNIT_CLASSES[x] for x in self.unit_indices]
+        self.stats: np.ndarray = unit_stats(self.unit_indices)
+        stats = self.stats
+
+        first_strike = stats[:, FIRST_STRIKE].astype(bool)
+        initial_attack_only = stats[:, INITIAL_ATTACK_ONLY].astype(bool)
+        self.firing_lines: Dict[BattlePhase, Tuple[bool, ...]] = {
+            BattlePhase.first_strike: tuple(first_strike.tolist()),
+            BattlePhase.second_strike: tuple((~first_strike).tolist()),
+            BattlePhase.general: (True,) * len(self.unit_indices),
+        }
+        # Whether units with `initial_attack_only` have used up their attack by the end of each phase
+        self.attacked: Dict[BattlePhase, Tuple[bool, ...]] = {
+            BattlePhase.first_strike: tuple((initial_attack_only & first_strike).tolist()),
+            BattlePhase.second_strike: tuple(initial_attack_only.tolist()),
+            BattlePhase.general: tuple(initial_attack_only.tolist()),
+        }
+        self.targetable: Dict[TargetSelect, Tuple[bool, ...]] = {
+            target_select: tuple(has_unit_type(unit_types)[self.unit_indices].tolist()) for target_select, unit_types in TARGET_SELECT_UNIT_TYPES.items()
+        }
+        self.aircraft: Tuple[bool, ...] = tuple((stats[:, UNIT_TYPE] == UNIT_TYPE_CODES[UnitType.aircraft]).tolist())
+
+        self.initial_attackers: Composition = self.composition(attackers)
+        self.initial_defenders: Composition = self.composition(defenders)
+        self.air_battle: bool = all(x.unit_type == UnitType.aircraft for x in attackers) or all(x.unit_type == UnitType.aircraft for x in defenders)
+
+        self._shots: Dict[tuple, List[Shot]] = {}
+        self._firepower: Dict[tuple, int] = {}
+        self._hits: Dict[tuple, Dict[LossCounts, float]] = {}
+        self._eligible: Dict[tuple, Composition] = {}
+        self._selections: Dict[tuple, Composition] = {}
+        self._remaining: Dict[tuple, Composition] = {}
+        self._loss_caps: Dict[Composition, LossCounts] = {}
+        self._losses: Dict[tuple, Composition] = {}
+        self._survivors: Dict[tuple, Survivors] = {}
+        # Filled in by `solve_general_rounds`, attacker win probabilities indexed by attacker and defender state
+        self.general_attackers: Dict[Composition, int] = {}
+        self.general_defenders: Dict[Composition, int] = {}
+        self.win_probabilities: np.ndarray = np.zeros((0, 0))
+
+    def composition(self, units: List[Unit]) -> Composition:
+        counts = army_counts(units)
+        return tuple(counts[x] for x in self.unit_indices)
+
+    def instantiate(self, composition: Composition, attacked_by: Optional[BattlePhase] = None) -> ArmyState:
+        """
+        Creates fresh units for a composition, ordered like `unit_classes`
+        Args:
+            attacked_by (Optional[BattlePhase]): Units which have used up their initial attack by the end of this phase are marked as such
+        """
+        attacked = self.attacked[attacked_by] if attacked_by else (False,) * len(self.unit_classes)
+        units = army_from_counts(zip(self.unit_classes, composition))
+        flags = [already_attacked for count, already_attacked in zip(composition, attacked) for _ in range(count)]
+        return ArmyState(tuple(units), (True,) * len(units), tuple(flags))
+
+    def get_shots(self, firing: Composition, attack: bool, initial_round: bool, attacked_by: Optional[BattlePhase]) -> List[Shot]:
+        """
+        Gets every shot fired by `firing`, following the same order and synergy pairing as `get_losses`
+        """
+        key = (firing, attack, initial_round, attacked_by)
+        if key in self._shots:
+            return self._shots[key]
+
+        self._shots[key] = get_shots(self.instantiate(firing, attacked_by), self.terrain, attack, initial_round)
+        return self._shots[key]
+
+    def get_phase_shots(self, firing: Composition, attack: bool, phase: BattlePhase) -> List[Shot]:
+        """
+        Gets the shots `firing` takes during a round of `phase`
+        """
+        return self.get_shots(firing, attack, phase != BattlePhase.general, PREVIOUS_PHASES[phase])
+
+    def get_firepower(self, units: Composition, attack: bool, phase: BattlePhase) -> int:
+        """
+        Expected hits (in d12 faces) of `units` as `objectively_evaluate_armies` would score them after `phase`
+        """
+        key = (units, attack, phase)
+        if key not in self._firepower:
+            self._firepower[key] = get_expected_hit_faces(self.instantiate(units, phase).key(), self.terrain, attack)
+        return self._firepower[key]
+
+    def eligible(self, units: Composition, target_select: Optional[TargetSelect]) -> Composition:
+        if not target_select:
+            return units
+        key = (units, target_select)
+        if key not in self._eligible:
+            self._eligible[key] = tuple(count if targetable else 0 for count, targetable in zip(units, self.targetable[target_select]))
+        return self._eligible[key]
+
+    def select_losses(self, units: Composition, count: int, attack: bool, phase: BattlePhase, target_select: Optional[TargetSelect] = None) -> Composition:
+        """
+        Removes `count` units in the same way as `loss_selector`: the weakest units are lost unless the enemy target selected them
+        """
+        if count == 0:
+            return units
+
+        remaining_key = (units, count, attack, phase, target_select)
+        if remaining_key in self._remaining:
+            return self._remaining[remaining_key]
+
+        eligible = self.eligible(units, target_select)
+        key = (eligible, count, attack, phase, target_select)
+        if not any(eligible):
+            losses = eligible
+        elif key in self._selections:
+            losses = self._selections[key]
+        elif sum(eligible) <= count:
+            losses = eligible
+        else:
+            losses = None
+            best_firepower = None
+            for candidate in get_loss_compositions(eligible, count):
+                firepower = self.get_firepower(candidate, attack, phase)
+                if best_firepower is None or (not target_select and firepower < best_firepower) or (target_select and firepower > best_firepower):
+                    best_firepower = firepower
+                    losses = candidate
+            self._selections[key] = losses
+
+        self._remaining[remaining_key] = tuple(current - lost for current, lost in zip(units, losses))
+        return self._remaining[remaining_key]
+
+    def take_losses(self, units: Composition, losses: LossCounts, attack: bool, phase: BattlePhase) -> Composition:
+        key = (units, losses, attack, phase)
+        if key not in self._losses:
+            ground_naval_losses, vehicle_select_losses, total_losses = losses
+            survivors = self.select_losses(units, ground_naval_losses, attack, phase, TargetSelect.ground_and_naval)
+            survivors = self.select_losses(survivors, vehicle_select_losses, attack, phase, TargetSelect.vehicle)
+            survivors = self.select_losses(survivors, total_losses, attack, phase)
+            self._losses[key] = survivors
+        return self._losses[key]
+
+    def hit_distribution(self, firing: Composition, attack: bool, phase: BattlePhase) -> Dict[LossCounts, float]:
+        """
+        Exact distribution of the hits scored by `firing` in a round of `phase`
+        """
+        key = (firing, attack, phase)
+        if key in self._hits:
+            return self._hits[key]
+
+        units = self.instantiate(firing, PREVIOUS_PHASES[phase])
+        initial_round = phase != BattlePhase.general
+        if attack:
+            _, round_results = get_loss_distributions(units, ArmyState.from_units([]), self.terrain, initial_round=initial_round)
+        else:
+            round_results, _ = get_loss_distributions(ArmyState.from_units([]), units, self.terrain, initial_round=initial_round)
+
+        distribution: Dict[LossCounts, float] = {}
+        for (regular, vehicle, ground), probability in round_results.items():
+            hits = (ground, vehicle, regular + vehicle + ground)
+            distribution[hits] = distribution.get(hits, 0.0) + probability
+
+        self._hits[key] = distribution
+        return distribution
+
+    def loss_caps(self, targets: Composition) -> LossCounts:
+        """
+        Most hits of each kind `targets` can lose units to, hits beyond them change nothing so capping them keeps the
+        casualty selections few
+        """
+        if targets not in self._loss_caps:
+            self._loss_caps[targets] = (sum(self.eligible(targets, TargetSelect.ground_and_naval)), sum(self.eligible(targets, TargetSelect.vehicle)), sum(targets))
+        return self._loss_caps[targets]
+
+    def cap_losses(self, targets: Composition, losses: LossCounts) -> LossCounts:
+        return tuple(min(hits, cap) for hits, cap in zip(losses, self.loss_caps(targets)))
+
+    def general_survivors(self, targets: Composition, losses: np.ndarray, attack: bool) -> List[Composition]:
+        """
+        What remains of `targets` after a general round for each row of hits in `losses`, casualties are only
+        selected once for every distinct number of hits after capping
+        """
+        capped, inverse = np.unique(np.minimum(losses, self.loss_caps(targets)), axis=0, return_inverse=True)
+        survivors = [self.take_losses(targets, tuple(x), attack, BattlePhase.general) for x in capped.tolist()]
+        return [survivors[x] for x in inverse.ravel().tolist()]
+
+    def get_survivors(self, targets: Composition, firing: Composition, attack: bool, phase: BattlePhase) -> Survivors:
+        """
+        Distribution of what remains of `targets` after `firing` shoots at them for a round
+        Args:
+            attack (bool): `targets` are the attackers
+        """
+        key = (targets, firing, attack, phase)
+        if key in self._survivors:
+            return self._survivors[key]
+
+        indices: Dict[Composition, int] = {}
+        probabilities: List[float] = []
+        for losses, probability in self.hit_distribution(firing, not attack, phase).items():
+            survivor = self.take_losses(targets, self.cap_losses(targets, losses), attack, phase)
+            if survivor not in indices:
+                indices[survivor] = len(probabilities)
+                probabilities.append(0.0)
+            probabilities[indices[survivor]] += probability
+
+        self._survivors[key] = (list(indices), np.array(probabilities))
+        return self._survivors[key]
+
+    def firing_line(self, units: Composition, phase: BattlePhase) -> Composition:
+        return tuple(count if firing else 0 for count, firing in zip(units, self.firing_lines[phase]))
+
+    def battle_round(self, attackers: Composition, defenders: Composition, phase: BattlePhase) -> Tuple[Survivors, Survivors]:
+        """
+        Survivor distributions of both sides after a round, the two are independent of each other
+        """
+        attacking_survivors = self.get_survivors(attackers, self.firing_line(defenders, phase), True, phase)
+        defending_survivors = self.get_survivors(defenders, self.firing_line(attackers, phase), False, phase)
+        return attacking_survivors, defending_survivors
+
+    def victory_probability(self, attackers: Composition, defenders: Composition) -> float:
+        """
+        Result of a finished battle, mirrors the end of `Battle.battle`
+        """
+        if any(defenders):
+            return 0.0
+
+        if any(attackers):
+            if self.air_battle:
+                return 1.0
+            if any(count and not aircraft for count, aircraft in zip(attackers, self.aircraft)):
+                return 1.0
+
+        return 0.0
+
+    def general_states(self, attackers: Iterable[Composition], defenders: Iterable[Composition]) -> Tuple[List[Composition], List[Composition]]:
+        """
+        Every state each side can reach through general rounds starting from any of `attackers` and `defenders`,
+        sorted by number of surviving units. Hits are paired with every state of the side taking them, so a few
+        states which no battle reaches may be included as well
+        """
+        phase = BattlePhase.general
+        states = {True: set(attackers), False: set(defenders)}
+        new_states = {side: set(states[side]) for side in states}
+        # Hits each side has been seen to take, keyed by whether it is the attacker
+        hits: Dict[bool, Set[LossCounts]] = {True: set(), False: set()}
+        while new_states[True] or new_states[False]:
+            new_hits = {side: {x for firing in new_states[not side] for x in self.hit_distribution(firing, not side, phase)} - hits[side] for side in states}
+            reached = {side: set() for side in states}
+            for side in states:
+                all_hits = np.array(sorted(hits[side] | new_hits[side]), dtype=int).reshape(-1, 3)
+                added_hits = np.array(sorted(new_hits[side]), dtype=int).reshape(-1, 3)
+                for targets in states[side]:
+                    # States found in the last pass meet every hit, older ones only the hits which are new
+                    losses = all_hits if targets in new_states[side] else added_hits
+                    if len(losses):
+                        reached[side].update(self.general_survivors(targets, losses, side))
+
+            for side in states:
+                hits[side] |= new_hits[side]
+                new_states[side] = reached[side] - states[side]
+                states[side] |= new_states[side]
+
+        return sorted(states[True], key=sum), sorted(states[False], key=sum)
+
+    def solve_general_rounds(self, attackers: Iterable[Composition], defenders: Iterable[Composition]):
+        """
+        Works out the attacker win probability from the start of a general round for every pair of states reachable
+        from `attackers` and `defenders`, into `win_probabilities`
+
+        States are gone through bottom-up by number of surviving units, so everything a round can lead to is known
+        before it is needed, except staying put which is divided out. Each attacker state is a handful of array
+        operations over all the defender states at once, level by level of defender units
+        """
+        phase = BattlePhase.general
+        attacker_states, defender_states = self.general_states(attackers, defenders)
+        self.general_attackers = {x: i for i, x in enumerate(attacker_states)}
+        self.general_defenders = {x: i for i, x in enumerate(defender_states)}
+        attacker_count, defender_count = len(attacker_states), len(defender_states)
+
+        # Hits taken by each side and the chance of each state scoring them
+        attacker_losses = sorted({x for firing in defender_states for x in self.hit_distribution(firing, False, phase)})
+        defender_losses = sorted({x for firing in attacker_states for x in self.hit_distribution(firing, True, phase)})
+        attacker_hits = self.hit_probabilities(attacker_states, defender_losses, True)
+        defender_hits = self.hit_probabilities(defender_states, attacker_losses, False)
+
+        # Index of the state left by every state for each number of hits it takes
+        attacker_survivors = self.survivor_indices(attacker_states, attacker_losses, self.general_attackers, True)
+        defender_survivors = self.survivor_indices(defender_states, defender_losses, self.general_defenders, False)
+        defender_transition_index = (np.arange(defender_count)[:, None] * defender_count + defender_survivors).ravel()
+
+        win_probabilities = np.zeros((attacker_count, defender_count))
+        for index, defenders in enumerate(defender_states):
+            if not any(defenders):
+                win_probabilities[:, index] = [self.victory_probability(x, defenders) for x in attacker_states]
+
+        # Defender states with the same number of units can not lead to one another, only to themselves
+        defender_sizes = np.array([sum(x) for x in defender_states])
+        starts = np.flatnonzero(np.diff(defender_sizes, prepend=-1))
+        levels = [slice(start, stop) for start, stop in zip(starts, [*starts[1:], defender_count]) if defender_sizes[start]]
+
+        for index, attackers in enumerate(attacker_states):
+            if not any(attackers):
+                continue
+
+            # Chance of every defender state leaving each of the states `attackers` can be left with
+            survivors, inverse = np.unique(attacker_survivors[index], return_inverse=True)
+            attacker_transitions = defender_hits @ np.eye(len(survivors))[inverse]
+            stay = np.zeros(defender_count)
+            if survivors[-1] == index:
+                # A round without attacker losses, every other survivor has fewer units and is already solved
+                stay = attacker_transitions[:, -1].copy()
+                attacker_transitions[:, -1] = 0.0
+
+            # Chance of every defender state being left as every other one by `attackers`
+            defender_transitions = np.bincount(defender_transition_index, weights=np.tile(attacker_hits[index], defender_count), minlength=defender_count * defender_count).reshape(defender_count, defender_count)
+            moved = (attacker_transitions * (win_probabilities[survivors] @ defender_transitions.T).T).sum(axis=1)
+
+            row = win_probabilities[index]
+            stalemates = stay * defender_transitions.diagonal()
+            for level in levels:
+                probability = moved[level] + stay[level] * (defender_transitions[level] @ row)
+                stalemate = stalemates[level]
+                # Neither side can ever score a hit, the attack fails to take the territory
+                row[level] = np.where(stalemate >= 1 - 1e-12, 0.0, probability / np.maximum(1 - stalemate, 1e-12))
+
+        self.win_probabilities = win_probabilities
+
+    def hit_probabilities(self, states: List[Composition], losses: List[LossCounts], attack: bool) -> np.ndarray:
+        """
+        Chance of every state in `states` scoring each of `losses` in a general round
+        """
+        loss_indices = {x: i for i, x in enumerate(losses)}
+        probabilities = np.zeros((len(states), len(losses)))
+        for index, firing in enumerate(states):
+            for hits, probability in self.hit_distribution(firing, attack, BattlePhase.general).items():
+                probabilities[index, loss_indices[hits]] = probability
+        return probabilities
+
+    def survivor_indices(self, states: List[Composition], losses: List[LossCounts], state_indices: Dict[Composition, int], attack: bool) -> np.ndarray:
+        """
+        Index of the state every state in `states` is left as by each of `losses` in a general round
+        """
+        loss_array = np.array(losses, dtype=int).reshape(-1, 3)
+        survivors = [state_indices[x] for targets in states for x in self.general_survivors(targets, loss_array, attack)]
+        return np.array(survivors, dtype=np.intp).reshape(len(states), len(losses))
+
+    def general_win_probability(self, attackers: Composition, defenders: Composition) -> float:
+        """
+        Probability of an attacker victory from the start of a general round
+        """
+        if not any(attackers) or not any(defenders):
+            return self.victory_probability(attackers, defenders)
+
+        if attackers not in self.general_attackers or defenders not in self.general_defenders:
+            self.solve_general_rounds([attackers], [defenders])
+        return float(self.win_probabilities[self.general_attackers[attackers], self.general_defenders[defenders]])
+
+    def attacker_win_probability(self) -> float:
+        """
+        Exact probability that the battle ends in `BattleResult.attacker_victory`
+        """
+        # Survivors of both strikes with their joint probabilities, where the general rounds start from
+        starts: List[Tuple[List[Composition], List[Composition], np.ndarray]] = []
+        (first_attackers, first_attacker_probabilities), (first_defenders, first_defender_probabilities) = self.battle_round(self.initial_attackers, self.initial_defenders, BattlePhase.first_strike)
+        for first_attacker, first_attacker_probability in zip(first_attackers, first_attacker_probabilities):
+            for first_defender, first_defender_probability in zip(first_defenders, first_defender_probabilities):
+                (second_attackers, second_attacker_probabilities), (second_defenders, second_defender_probabilities) = self.battle_round(first_attacker, first_defender, BattlePhase.second_strike)
+                probabilities = first_attacker_probability * first_defender_probability * np.outer(second_attacker_probabilities, second_defender_probabilities)
+                starts.append((second_attackers, second_defenders, probabilities))
+
+        self.solve_general_rounds({x for attackers, _, _ in starts for x in attackers}, {x for _, defenders, _ in starts for x in defenders})
+        probability = 0.0
+        for attackers, defenders, probabilities in starts:
+            rows = [self.general_attackers[x] for x in attackers]
+            columns = [self.general_defenders[x] for x in defenders]
+            probability += float((probabilities * self.win_probabilities[np.ix_(rows, columns)]).sum())
+        return probability
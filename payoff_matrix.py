@@ -0,0 +1,110 @@
+from typing import List, Optional, Tuple, Type
+import json
+import os
+import numpy as np
+from terrains import Terrain, TERRAIN_TYPES
+from dice import Seed, as_seed_sequence
+from battle_statistics import BattleEngine, UnitBuild, army_from_build, compare_armies_in_terrain
+from simulation_executor import SimulationExecutor, InlineExecutor, get_default_executor
+
+# Cells each worker is given between two checkpoints
+CELLS_PER_CHECKPOINT = 8
+
+# A cell as the positions of its terrain and of both builds
+Cell = Tuple[int, int, int]
+
+
+def _score_cell(side_1: UnitBuild, side_2: UnitBuild, terrain: Type[Terrain], n: int, engine: BattleEngine, seed: np.random.SeedSequence) -> float:
+    """
+    Helper function to be ran inside of a worker
+    """
+    return compare_armies_in_terrain(army_from_build(side_1), army_from_build(side_2), terrain, n, engine=engine, executor=InlineExecutor(), seed=seed)
+
+
+class PayoffMatrix:
+    """
+    `compare_armies_in_terrain` of every build against every other build in every terrain, as
+    `scores[terrain, build, opponent]`
+
+    The scores live in a memory mapped .npy file in `directory`, with NaN for the cells not scored yet. They are flushed
+    after every batch of cells, so a run which is stopped picks up where it left off when built again. Since
+    `compare_armies_in_terrain(b, a)` is `1 - compare_armies_in_terrain(a, b)`, only the cells above the diagonal are
+    fought and a build against itself scores 0.5
+    Args:
+        directory (str): Holds `scores.npy` and a `manifest.json` which a resumed run has to match
+        n (int): Battles for every cell
+        seed (Optional[Seed]): Every cell is seeded from it by its position, so the scores do not depend on the order the cells are fought in
+    """
+    def __init__(self, builds: List[UnitBuild], directory: str, terrains: Optional[List[Type[Terrain]]] = None, n: int = 20_000, *, engine: BattleEngine = BattleEngine.vectorized, executor: Optional[SimulationExecutor] = None, seed: Optional[Seed] = None):
+        self.builds: List[UnitBuild] = builds
+        self.directory: str = directory
+        self.terrains: List[Type[Terrain]] = terrains or TERRAIN_TYPES
+        self.n: int = n
+        self.engine: BattleEngine = engine
+        self.executor: Optional[SimulationExecutor] = executor
+
+        os.makedirs(directory, exist_ok=True)
+        manifest = {
+            "builds": [{unit_class.__name__: count for unit_class, count in build.items()} for build in builds],
+            "terrains": [terrain.__name__ for terrain in self.terrains],
+            "n": n,
+            "engine": engine.name,
+        }
+        scores_path = os.path.join(directory, "scores.npy")
+        manifest_path = os.path.join(directory, "manifest.json")
+        shape = (len(self.terrains), len(builds), len(builds))
+        if os.path.exists(manifest_path) and os.path.exists(scores_path):
+            with open(manifest_path) as f:
+                stored = json.load(f)
+            entropy = stored.pop("entropy")
+            spawn_key = stored.pop("spawn_key")
+            if stored != manifest:
+                raise ValueError(f"{directory} holds a different payoff matrix")
+            self.scores: np.ndarray = np.lib.format.open_memmap(scores_path, mode="r+")
+        else:
+            seed_sequence = as_seed_sequence(seed)
+            entropy = str(seed_sequence.entropy)
+            spawn_key = list(seed_sequence.spawn_key)
+            self.scores = np.lib.format.open_memmap(scores_path, mode="w+", dtype=np.float64, shape=shape)
+            self.scores[:] = np.nan
+            for terrain_index in range(len(self.terrains)):
+                np.fill_diagonal(self.scores[terrain_index], 0.5)
+            self.scores.flush()
+            with open(manifest_path, "w") as f:
+                json.dump({**manifest, "entropy": entropy, "spawn_key": spawn_key}, f)
+
+        self.entropy: int = int(entropy)
+        self.spawn_key: Tuple[int, ...] = tuple(spawn_key) # of the seed, so matrices seeded from its siblings differ
+
+    def pending_cells(self) -> List[Cell]:
+        """
+        Cells above the diagonal which have not been scored yet
+        """
+        terrain_indices, builds, opponents = np.nonzero(np.isnan(self.scores))
+        return [cell for cell in zip(terrain_indices.tolist(), builds.tolist(), opponents.tolist()) if cell[1] < cell[2]]
+
+    def cell_seed(self, cell: Cell) -> np.random.SeedSequence:
+        return np.random.SeedSequence(self.entropy, spawn_key=(*self.spawn_key, *cell))
+
+    def build(self) -> np.ndarray:
+        """
+        Scores every pending cell, checkpointing after every batch
+        """
+        executor = self.executor or get_default_executor()
+        cells = self.pending_cells()
+        batch_size = executor.processes * CELLS_PER_CHECKPOINT
+        for start in range(0, len(cells), batch_size):
+            batch = cells[start:start + batch_size]
+            tasks = [
+                (self.builds[build], self.builds[opponent], self.terrains[terrain_index], self.n, self.engine, self.cell_seed((terrain_index, build, opponent)))
+                for terrain_index, build, opponent in batch
+            ]
+            for (terrain_index, build, opponent), score in zip(batch, executor.starmap(_score_cell, tasks, 1)):
+                self.scores[terrain_index, build, opponent] = score
+                self.scores[terrain_index, opponent, build] = 1 - score
+            self.scores.flush()
+        return self.scores
+
+    @property
+    def done(self) -> bool:
+        return not np.isnan(self.scores).any()
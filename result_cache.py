@@ -0,0 +1,106 @@
+from typing import List, Optional, Tuple, Type
+import sqlite3
+from units import Unit
+from terrains import Terrain
+from unit_table import UNIT_CLASSES, army_counts
+from battle_statistics import BattleEngine, count_attacker_wins, simulate_battle_results
+from simulation_executor import SimulationExecutor
+
+# Bump whenever a change to the rules or the engines changes what a battle's result can be, results stored by
+# other versions are then ignored
+ENGINE_VERSION = 1
+
+# How the stored battles were sampled, every battle on fresh dice and independent of the others
+INDEPENDENT_SAMPLES = "independent"
+
+
+def canonical_army(army: List[Unit]) -> str:
+    """
+    Describes an army by how many of each class it has, the same for any order of its units
+    """
+    counts = army_counts(army)
+    return ",".join(f"{UNIT_CLASSES[index].__name__}:{count}" for index, count in sorted(enumerate(counts), key=lambda x: UNIT_CLASSES[x[0]].__name__) if count)
+
+
+class ResultCache:
+    """
+    Attacker win counts of simulated battles, kept in a SQLite file so that later sessions can reuse them or top them up
+
+    Results are keyed by both armies as given by `canonical_army`, the terrain, the engine, `ENGINE_VERSION` and
+    how the battles were sampled. Exact results are never stored since nothing is sampled for them
+    Args:
+        path (str): SQLite file, created if it does not exist yet
+    """
+    def __init__(self, path: str = "battle_results.sqlite3"):
+        self.path: str = path
+        self.connection: sqlite3.Connection = sqlite3.connect(path)
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS results (
+                attackers TEXT NOT NULL,
+                defenders TEXT NOT NULL,
+                terrain TEXT NOT NULL,
+                engine TEXT NOT NULL,
+                engine_version INTEGER NOT NULL,
+                sampling TEXT NOT NULL,
+                battles INTEGER NOT NULL,
+                attacker_wins INTEGER NOT NULL,
+                PRIMARY KEY (attackers, defenders, terrain, engine, engine_version, sampling)
+            )
+        """)
+        self.connection.commit()
+
+    def __enter__(self) -> "ResultCache":
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    def key(self, attackers: List[Unit], defenders: List[Unit], terrain: Type[Terrain], engine: BattleEngine, sampling: str = INDEPENDENT_SAMPLES) -> Tuple[str, str, str, str, int, str]:
+        return canonical_army(attackers), canonical_army(defenders), terrain.__name__, engine.name, ENGINE_VERSION, sampling
+
+    def get(self, attackers: List[Unit], defenders: List[Unit], terrain: Type[Terrain], engine: BattleEngine = BattleEngine.monte_carlo) -> Tuple[int, int]:
+        """
+        Gets the stored (battles, attacker wins), both 0 if nothing is stored yet
+        """
+        row = self.connection.execute("""
+            SELECT battles, attacker_wins FROM results
+            WHERE attackers = ? AND defenders = ? AND terrain = ? AND engine = ? AND engine_version = ? AND sampling = ?
+        """, self.key(attackers, defenders, terrain, engine)).fetchone()
+        return row if row else (0, 0)
+
+    def add(self, attackers: List[Unit], defenders: List[Unit], terrain: Type[Terrain], engine: BattleEngine, battles: int, attacker_wins: int):
+        """
+        Adds newly fought battles to what is stored
+        """
+        self.connection.execute("""
+            INSERT INTO results (attackers, defenders, terrain, engine, engine_version, sampling, battles, attacker_wins)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT DO UPDATE SET battles = battles + excluded.battles, attacker_wins = attacker_wins + excluded.attacker_wins
+        """, (*self.key(attackers, defenders, terrain, engine), battles, attacker_wins))
+        self.connection.commit()
+
+    def simulate_battle_results(self, attackers: List[Unit], defenders: List[Unit], terrain: Type[Terrain], n: int = 10_000, *, engine: BattleEngine = BattleEngine.monte_carlo, executor: Optional[SimulationExecutor] = None) -> float:
+        """
+        `battle_statistics.simulate_battle_results` which only fights the battles it does not have stored yet.
+        Every stored battle is used, even when there are more than `n`
+        """
+        if engine == BattleEngine.exact:
+            return simulate_battle_results(attackers, defenders, terrain, engine=engine)
+
+        battles, attacker_wins = self.get(attackers, defenders, terrain, engine)
+        if battles < n:
+            new_wins = count_attacker_wins(attackers, defenders, terrain, n - battles, engine=engine, executor=executor)
+            self.add(attackers, defenders, terrain, engine, n - battles, new_wins)
+            battles, attacker_wins = n, attacker_wins + new_wins
+        return attacker_wins / battles
+
+    def compare_armies_in_terrain(self, side_1: List[Unit], side_2: List[Unit], terrain: Type[Terrain], n: int = 20_000, *, engine: BattleEngine = BattleEngine.monte_carlo, executor: Optional[SimulationExecutor] = None) -> float:
+        """
+        `battle_statistics.compare_armies_in_terrain` on the stored battles
+        """
+        battle_type_1_results = self.simulate_battle_results(side_1, side_2, terrain, int(n/2), engine=engine, executor=executor)
+        battle_type_2_results = 1 - self.simulate_battle_results(side_2, side_1, terrain, int(n/2), engine=engine, executor=executor)
+        return (battle_type_1_results + battle_type_2_results) / 2
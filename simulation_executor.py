@@ -0,0 +1,98 @@
+from typing import Callable, Iterable, List, Optional
+from multiprocessing import Pool
+import multiprocessing.pool
+import atexit
+import itertools
+import os
+
+
+def _warm_start():
+    """
+    Ran once in every worker as it starts, so the first battle sent to it does not pay for the imports
+    """
+    import units
+    import terrains
+    import battle
+
+
+class SimulationExecutor:
+    """
+    Long lived pool of worker processes which battles are farmed out to
+
+    The workers are started once and reused by every call, either as a context manager or through
+    `get_default_executor`, instead of forking a new pool for each simulation
+    Args:
+        processes (Optional[int]): Number of workers, every CPU of the machine by default
+    """
+    def __init__(self, processes: Optional[int] = None):
+        self.processes: int = processes or os.cpu_count() or 1
+        self._pool: Optional[multiprocessing.pool.Pool] = None
+
+    def __enter__(self) -> "SimulationExecutor":
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @property
+    def running(self) -> bool:
+        return self._pool is not None
+
+    def start(self):
+        if self._pool is None:
+            self._pool = Pool(processes=self.processes, initializer=_warm_start)
+
+    def map(self, function: Callable, iterable: Iterable, chunksize: Optional[int] = None) -> List:
+        """
+        `Pool.map` on the workers, starting them if they are not running yet
+        """
+        self.start()
+        return self._pool.map(function, iterable, chunksize)
+
+    def starmap(self, function: Callable, iterable: Iterable, chunksize: Optional[int] = None) -> List:
+        """
+        `Pool.starmap` on the workers, starting them if they are not running yet
+        """
+        self.start()
+        return self._pool.starmap(function, iterable, chunksize)
+
+    def close(self):
+        """
+        Stops the workers, a later call starts new ones
+        """
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+
+class InlineExecutor(SimulationExecutor):
+    """
+    Runs everything in the calling process, for simulations which are themselves ran on a worker
+    """
+    def __init__(self):
+        super().__init__(1)
+
+    def start(self):
+        pass
+
+    def map(self, function: Callable, iterable: Iterable, chunksize: Optional[int] = None) -> List:
+        return list(map(function, iterable))
+
+    def starmap(self, function: Callable, iterable: Iterable, chunksize: Optional[int] = None) -> List:
+        return list(itertools.starmap(function, iterable))
+
+
+_default_executor: Optional[SimulationExecutor] = None
+
+
+def get_default_executor() -> SimulationExecutor:
+    """
+    The executor shared by every simulation which is not given its own, closed when the interpreter exits
+    """
+    global _default_executor
+    if _default_executor is None:
+        _default_executor = SimulationExecutor()
+        atexit.register(_default_executor.close)
+    return _default_executor
@@ -1,20 +1,64 @@
 from units import *
-from typing import List
+from typing import Callable, Type
+from unit_table import UNIT_CLASSES
+
+
+class ModifierTable(dict):
+    """
+    Class -> modifier, working out and storing the modifier of classes declared after the terrain on first sight
+    """
+    def __init__(self, modifier: Callable[[Type[Unit]], int]):
+        super().__init__((x, modifier(x)) for x in UNIT_CLASSES)
+        self.modifier: Callable[[Type[Unit]], int] = modifier
+
+    def __missing__(self, unit_class: Type[Unit]) -> int:
+        self[unit_class] = self.modifier(unit_class)
+        return self[unit_class]
+
 
 class Terrain:
+    # Compiled from `attack_modifier` and `defense_modifier` when the terrain is declared
+    attack_modifiers: ModifierTable
+    defense_modifiers: ModifierTable
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.compile_modifiers()
+
+    @classmethod
+    def compile_modifiers(cls):
+        cls.attack_modifiers = ModifierTable(cls.attack_modifier)
+        cls.defense_modifiers = ModifierTable(cls.defense_modifier)
+
+    @classmethod
+    def attack_modifier(cls, unit_class: Type[Unit]) -> int:
+        """
+        How much the terrain changes the attack of every unit of `unit_class`, synergy aside
+        """
+        return 0
+
     @classmethod
-    def modified_attack(cls, unit: Unit, friendlies: List[Unit]) -> int:
+    def defense_modifier(cls, unit_class: Type[Unit]) -> int:
+        """
+        How much the terrain changes the defense of every unit of `unit_class`, synergy aside
+        """
+        return 0
+
+    @classmethod
+    def modified_attack(cls, unit: Unit, paired: bool = False) -> int:
         """
         Gets the attack of the unit when terrain is taken into consideration
         """
-        return unit.get_attack(friendlies)
+        return unit.get_attack(paired) + cls.attack_modifiers[type(unit)]
 
     @classmethod
-    def modified_defense(cls, unit: Unit, friendlies: List[Unit]) -> int:
+    def modified_defense(cls, unit: Unit, paired: bool = False) -> int:
         """
         Gets the defense of the unit when terrain is taken into consideration
         """
-        return unit.get_defense(friendlies)
+        return unit.get_defense(paired) + cls.defense_modifiers[type(unit)]
+
+Terrain.compile_modifiers()
 
 class Basic(Terrain):
     ...
@@ -27,42 +71,36 @@ class Basic(Terrain):
 # terrain in a battle
 class Desert(Terrain):
     @classmethod
-    def modified_attack(cls, unit: Unit, friendlies: List[Unit]) -> int:
-        if unit.unit_type == UnitType.aircraft:
-            return unit.get_attack(friendlies)
-        return unit.get_attack(friendlies) - 1
+    def attack_modifier(cls, unit_class: Type[Unit]) -> int:
+        if unit_class.unit_type == UnitType.aircraft:
+            return 0
+        return -1
 
 class Mountain(Terrain):
     @classmethod
-    def modified_attack(cls, unit: Unit, friendlies: List[Unit]) -> int:
-        if isinstance(unit, MountainInfantry) or unit.unit_type == UnitType.aircraft:
-            return unit.get_attack(friendlies)
-        return unit.get_attack(friendlies) - 1
+    def attack_modifier(cls, unit_class: Type[Unit]) -> int:
+        if issubclass(unit_class, MountainInfantry) or unit_class.unit_type == UnitType.aircraft:
+            return 0
+        return -1
 
     @classmethod
-    def modified_defense(cls, unit: Unit, friendlies: List[Unit]) -> int:
-        if isinstance(unit, MountainInfantry):
-            return unit.get_defense(friendlies) + 1
-        return unit.get_defense(friendlies)
+    def defense_modifier(cls, unit_class: Type[Unit]) -> int:
+        if issubclass(unit_class, MountainInfantry):
+            return 1
+        return 0
 
 class Marsh(Terrain):
     @classmethod
-    def modified_attack(cls, unit: Unit, friendlies: List[Unit]) -> int:
-        """
-        Gets the attack of the unit when terrain is taken into consideration
-        """
-        if unit.unit_type == UnitType.vehicle:
-            return unit.get_attack(friendlies) - 2
-        return unit.get_attack(friendlies)
+    def attack_modifier(cls, unit_class: Type[Unit]) -> int:
+        if unit_class.unit_type == UnitType.vehicle:
+            return -2
+        return 0
 
     @classmethod
-    def modified_defense(cls, unit: Unit, friendlies: List[Unit]) -> int:
-        """
-        Gets the attack of the unit when terrain is taken into consideration
-        """
-        if unit.unit_type == UnitType.vehicle:
-            return unit.get_defense(friendlies) - 2
-        return unit.get_defense(friendlies)
+    def defense_modifier(cls, unit_class: Type[Unit]) -> int:
+        if unit_class.unit_type == UnitType.vehicle:
+            return -2
+        return 0
 
 
 class Jungle(Marsh):
@@ -70,15 +108,15 @@ class Jungle(Marsh):
 
 class City(Terrain):
     @classmethod
-    def modified_defense(cls, unit: Unit, friendlies: List[Unit]) -> int:
+    def defense_modifier(cls, unit_class: Type[Unit]) -> int:
         # Infantry in cities that are defending get a level 1 target select against vehicles
-        if unit.unit_type == UnitType.infantry:
-            return unit.get_defense(friendlies) + 1
-        return unit.get_defense(friendlies) 
+        if unit_class.unit_type == UnitType.infantry:
+            return 1
+        return 0
 
 class SurroundedCity(Terrain):
     @classmethod
-    def modified_defense(cls, unit: Unit, friendlies: List[Unit]) -> int:
-        return unit.get_defense(friendlies) - 1
+    def defense_modifier(cls, unit_class: Type[Unit]) -> int:
+        return -1
 
-TERRAIN_TYPES = [Basic, Mountain, Marsh, Jungle, City, SurroundedCity]
\ No newline at end of file
+TERRAIN_TYPES = [Basic, Mountain, Marsh, Jungle, City, SurroundedCity]
@@ -0,0 +1,122 @@
+from typing import List, Optional, Tuple, Type
+from dataclasses import dataclass
+import numpy as np
+from terrains import Terrain, TERRAIN_TYPES
+from dice import Seed, as_seed_sequence
+from battle_statistics import BattleEngine, UnitBuild, army_from_build, estimate_armies_in_terrain
+from simulation_executor import SimulationExecutor, InlineExecutor, get_default_executor
+
+# Elo rating every build starts from
+INITIAL_RATING = 1500.0
+
+
+def _play_matchup(side_1: UnitBuild, side_2: UnitBuild, terrain: Type[Terrain], battles: int, engine: BattleEngine, seed: np.random.SeedSequence) -> float:
+    """
+    Helper function to be ran inside of a worker, scores `side_1` against `side_2` like `compare_armies_in_terrain`
+    """
+    return estimate_armies_in_terrain(army_from_build(side_1), army_from_build(side_2), terrain, battles, engine=engine, executor=InlineExecutor(), seed=seed).score
+
+
+@dataclass
+class Rating:
+    build: UnitBuild
+    elo: float = INITIAL_RATING
+    matchups: int = 0
+    score: float = 0 # summed over every matchup, 1 for a matchup won outright
+
+    def __str__(self):
+        build = ", ".join(f"{count} {unit_class.__name__}" for unit_class, count in self.build.items())
+        return f"{self.elo:7.1f} ({self.matchups} matchups) {build}"
+
+
+# A matchup as the positions of both builds in `Tournament.ratings` and the terrain it is fought on
+Matchup = Tuple[int, int, Type[Terrain]]
+
+
+class Tournament:
+    """
+    Ranks builds with Elo ratings from far fewer battles than a round robin
+
+    Every round pairs each build with the closest rated build it can, starting from the builds which have played
+    the fewest matchups and so have the least certain ratings. The round's matchups are fought at the same time on
+    the workers of the executor, then every rating is updated at once
+    Args:
+        terrains (Optional[List[Type[Terrain]]]): Terrains the matchups are fought on in turn, `TERRAIN_TYPES` by default
+        battle_budget (int): Battles the whole tournament may fight
+        battles_per_matchup (int): Battles fought for a single matchup, see `estimate_armies_in_terrain`
+        k_factor (float): Most a single matchup moves a rating
+        engine (BattleEngine): How the battles are fought, `BattleEngine.monte_carlo` runs each matchup on a single worker
+    """
+    def __init__(self, builds: List[UnitBuild], terrains: Optional[List[Type[Terrain]]] = None, battle_budget: int = 100_000, *, battles_per_matchup: int = 400, k_factor: float = 32, engine: BattleEngine = BattleEngine.vectorized, executor: Optional[SimulationExecutor] = None, seed: Optional[Seed] = None):
+        self.ratings: List[Rating] = [Rating(build) for build in builds]
+        self.terrains: List[Type[Terrain]] = terrains or TERRAIN_TYPES
+        self.battle_budget: int = battle_budget
+        self.battles_per_matchup: int = battles_per_matchup
+        self.k_factor: float = k_factor
+        self.engine: BattleEngine = engine
+        self.executor: Optional[SimulationExecutor] = executor
+        self.seeds: np.random.SeedSequence = as_seed_sequence(seed)
+        self.battles: int = 0
+        self.matchups: int = 0
+
+    @staticmethod
+    def expected_score(elo: float, opponent_elo: float) -> float:
+        return 1 / (1 + 10 ** ((opponent_elo - elo) / 400))
+
+    def schedule(self, count: int) -> List[Matchup]:
+        """
+        Pairs up to `count` matchups, the least played builds against the closest rated builds left
+        """
+        unpaired = sorted(range(len(self.ratings)), key=lambda x: (self.ratings[x].matchups, x))
+        matchups = []
+        while len(unpaired) >= 2 and len(matchups) < count:
+            build = unpaired.pop(0)
+            opponent = min(unpaired, key=lambda x: (abs(self.ratings[x].elo - self.ratings[build].elo), self.ratings[x].matchups))
+            unpaired.remove(opponent)
+            matchups.append((build, opponent, self.terrains[(self.matchups + len(matchups)) % len(self.terrains)]))
+        return matchups
+
+    def play_round(self) -> List[Tuple[Matchup, float]]:
+        """
+        Fights a round of matchups within what is left of the budget and updates the ratings
+        Returns:
+            List[Tuple[Matchup, float]]: Every matchup with the score of its first build
+        """
+        count = (self.battle_budget - self.battles) // self.battles_per_matchup
+        matchups = self.schedule(count)
+        if not matchups:
+            return []
+
+        executor = self.executor or get_default_executor()
+        tasks = [
+            (self.ratings[build].build, self.ratings[opponent].build, terrain, self.battles_per_matchup, self.engine, seed)
+            for (build, opponent, terrain), seed in zip(matchups, self.seeds.spawn(len(matchups)))
+        ]
+        scores = executor.starmap(_play_matchup, tasks, 1)
+
+        changes = [0.0] * len(self.ratings)
+        for (build, opponent, _), score in zip(matchups, scores):
+            change = self.k_factor * (score - self.expected_score(self.ratings[build].elo, self.ratings[opponent].elo))
+            changes[build] += change
+            changes[opponent] -= change
+            for position, position_score in ((build, score), (opponent, 1 - score)):
+                self.ratings[position].matchups += 1
+                self.ratings[position].score += position_score
+
+        for rating, change in zip(self.ratings, changes):
+            rating.elo += change
+
+        self.battles += len(matchups) * self.battles_per_matchup
+        self.matchups += len(matchups)
+        return list(zip(matchups, scores))
+
+    def run(self) -> List[Rating]:
+        """
+        Plays rounds until the battle budget is spent, returns the leaderboard
+        """
+        while self.play_round():
+            pass
+        return self.leaderboard()
+
+    def leaderboard(self) -> List[Rating]:
+        return sorted(self.ratings, key=lambda x: x.elo, reverse=True)
@@ -0,0 +1,111 @@
+from typing import Dict, Iterable, List, Optional, Tuple, Type
+import numpy as np
+import units
+from units import Unit, UnitType, TargetSelect
+
+# Every unit which can be fielded, in the order they are declared in `units`
+UNIT_CLASSES: List[Type[Unit]] = [
+    x for x in vars(units).values()
+    if isinstance(x, type) and issubclass(x, Unit) and x.attack_roll is not None
+]
+
+
+class UnitIndex(dict):
+    """
+    Position of every class in `UNIT_CLASSES`, registering the classes declared outside of `units` on first sight
+    """
+    def __missing__(self, unit_class: Type[Unit]) -> int:
+        return register_unit_class(unit_class)
+
+
+UNIT_INDEX: Dict[Type[Unit], int] = UnitIndex((unit_class, index) for index, unit_class in enumerate(UNIT_CLASSES))
+
+UNIT_TYPE_CODES: Dict[Optional[UnitType], int] = {None: 0, **{x: x.value for x in UnitType}}
+TARGET_SELECT_CODES: Dict[Optional[TargetSelect], int] = {None: 0, **{x: x.value for x in TargetSelect}}
+
+# Columns of `STAT_TABLE`
+ATTACK = 0
+DEFENSE = 1
+COST = 2
+UNIT_TYPE = 3
+FIRST_STRIKE = 4
+ATTACK_COUNT = 5
+TARGET_SELECT_ROLL = 6
+TARGET_SELECT_TYPE = 7
+INITIAL_ATTACK_ONLY = 8
+
+
+def _stat_row(unit_class: Type[Unit]) -> List[int]:
+    can_target_select = bool(unit_class.target_select_roll and unit_class.target_select_type)
+    return [
+        unit_class.attack_roll,
+        unit_class.defense_roll,
+        unit_class.cost,
+        UNIT_TYPE_CODES[unit_class.unit_type],
+        int(unit_class.first_strike),
+        unit_class.attack_count,
+        unit_class.target_select_roll if can_target_select else 0,
+        TARGET_SELECT_CODES[unit_class.target_select_type] if can_target_select else 0,
+        int(unit_class.initial_attack_only),
+    ]
+
+
+# One row of stats per class in `UNIT_CLASSES`
+STAT_TABLE: np.ndarray = np.array([_stat_row(x) for x in UNIT_CLASSES], dtype=np.int16)
+STAT_TABLE.flags.writeable = False
+
+
+
+def register_unit_class(unit_class: Type[Unit]) -> int:
+    """
+    Adds a class to the end of `UNIT_CLASSES` and `STAT_TABLE`, returns its position
+    """
+    global STAT_TABLE
+    if unit_class in UNIT_INDEX:
+        return UNIT_INDEX[unit_class]
+    if not (isinstance(unit_class, type) and issubclass(unit_class, Unit)) or unit_class.attack_roll is None:
+        raise TypeError(f"{unit_class!r} is not a unit class which can be fielded")
+
+    table = np.vstack([STAT_TABLE, np.array(_stat_row(unit_class), dtype=np.int16)])
+    table.flags.writeable = False
+    STAT_TABLE = table
+    UNIT_CLASSES.append(unit_class)
+    dict.__setitem__(UNIT_INDEX, unit_class, len(UNIT_CLASSES) - 1)
+    return len(UNIT_CLASSES) - 1
+
+
+def unit_stats(indices: List[int]) -> np.ndarray:
+    """
+    Rows of `STAT_TABLE` for the classes at `indices`. Use it rather than importing `STAT_TABLE`, which is replaced
+    whenever a class is registered
+    """
+    return STAT_TABLE[indices]
+
+
+# Number of units of each class in `UNIT_CLASSES`
+ArmyCounts = Tuple[int, ...]
+
+
+def army_counts(army: List[Unit]) -> ArmyCounts:
+    indices = [UNIT_INDEX[type(unit)] for unit in army]
+    counts = [0] * len(UNIT_CLASSES)
+    for index in indices:
+        counts[index] += 1
+    return tuple(counts)
+
+
+def army_from_counts(counts: Iterable[Tuple[Type[Unit], int]]) -> List[Unit]:
+    """
+    Creates fresh units for every (class, count), in the order they are given
+    """
+    army = []
+    for unit_class, count in counts:
+        army.extend(unit_class() for _ in range(count))
+    return army
+
+
+def has_unit_type(unit_types: List[Optional[UnitType]]) -> np.ndarray:
+    """
+    Whether each class of `UNIT_CLASSES` is one of `unit_types`
+    """
+    return np.isin(STAT_TABLE[:, UNIT_TYPE], [UNIT_TYPE_CODES[x] for x in unit_types])
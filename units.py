@@ -29,15 +29,10 @@ class Unit:
     initial_attack_only: bool = False
     target_select_roll: Optional[int] = None
     target_select_type: Optional[TargetSelect] = None
-    already_attacked: bool = False # used for those units with `initial_attack_only = True`, shows that an attack has already happened 
-    artillery_paired: bool = False # temp value to show that the unit is already paired with an artillery
-    simulation: bool = False # temp value to show that the unit should not make permenant changes to its state
-    already_dead: bool = False # temp value to show that the unit has been marked for death
+    artillery_synergy: bool = False # gets plus one when paired with an artillery, see `pair_artillery`
 
     def __str__(self):
-        name = type(self).__name__
-        dead_str = "[dead]" if self.already_dead else ""
-        return f"{dead_str}{name}" 
+        return type(self).__name__
 
     def __repr__(self):
         return str(self)
@@ -46,58 +41,42 @@ class Unit:
     def can_target_select(self):
         return self.target_select_roll and self.target_select_type
 
-    def get_attack(self, friendlies: List["Unit"]) -> int:
+    def get_attack(self, paired: bool = False) -> int:
         """
         Gets the attack for this given turn when including friendly unit synergy
-
-        **WARNING** This mutates the `Unit` object and one must run `reset_synergy` after
+        Args:
+            paired (bool): `pair_artillery` paired the unit with an artillery this round
         """
-        return self.attack_roll
+        return self.attack_roll + int(paired and self.artillery_synergy)
 
-    def get_defense(self, friendlies: List["Unit"]) -> int:
+    def get_defense(self, paired: bool = False) -> int:
         """
         Gets the defense for this given turn when including friendly unit synergy
-
-        **WARNING** This mutates the `Unit` object and one must run `reset_synergy` after
-        """
-        return self.defense_roll
-
-    def reset_synergy(self):
-        """
-        To be ran after running `get_attack` or `get_defense`
+        Args:
+            paired (bool): `pair_artillery` paired the unit with an artillery this round
         """
-        self.artillery_paired = False
-
-    def can_attack(self) -> bool:
-        if self.initial_attack_only:
-            if self.already_attacked:
-                return False
-            if not self.simulation:
-                self.already_attacked = True
-            return True
-        return True
+        return self.defense_roll + int(paired and self.artillery_synergy)
+
+
+def pair_artillery(firing: List[Unit], friendlies: List[Unit]) -> List[bool]:
+    """
+    Synergy stage of a round, pairs each unit of `firing` which gains from artillery with one of the artillery among
+    `friendlies`, in order, until the artillery runs out. Runs in linear time since only the count of artillery matters
+    Returns:
+        List[bool]: Whether each unit of `firing` is paired
+    """
+    artillery = sum(1 for x in friendlies if x.unit_type == UnitType.artilery)
+    paired = []
+    for unit in firing:
+        pair = unit.artillery_synergy and artillery > 0
+        if pair:
+            artillery -= 1
+        paired.append(pair)
+    return paired
 
 
 class InfantryUnit(Unit):
-    def get_attack(self, friendlies: List["Unit"]) -> int:
-        for friend in friendlies:
-            if friend == self:
-                continue
-            if friend.unit_type == UnitType.artilery and not friend.artillery_paired:
-                self.artillery_paired = True
-                friend.artillery_paired = True
-                return self.attack_roll + 1
-        return self.attack_roll
-
-    def get_defense(self, friendlies: List["Unit"]) -> int:
-        for friend in friendlies:
-            if friend == self:
-                continue
-            if friend.unit_type == UnitType.artilery and not friend.artillery_paired:
-                self.artillery_paired = True
-                friend.artillery_paired = True
-                return self.defense_roll + 1
-        return self.defense_roll
+    artillery_synergy = True
 
 class Militia(InfantryUnit):
     attack_roll = 1